@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# 流式写入的块大小：每个上传占用的内存只与块大小有关，与文件大小无关
+CHUNK_SIZE = 1024 * 1024
+# 引用计数索引默认放在项目根目录的 cache/uploads 下：上传目录可能位于静态文件目录中，索引不能被公开访问
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "uploads")
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes):
+        super().__init__(f"文件超过大小限制 {max_bytes // 1024 ** 2}MB")
+        self.max_bytes = max_bytes
+
+
+class MultipartUpload:
+    """
+    从请求体流中边接收边解析 multipart/form-data，只取出名为 field 的文件字段：
+    不经过 Starlette 的临时文件，调用方停止读取（例如超过大小限制）时剩余的请求体不再接收
+    """
+
+    def __init__(self, stream, content_type, field="file"):
+        self._stream = stream.__aiter__()
+        self.field = field
+        self.filename = None
+        _, options = parse_options_header(content_type or "")
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise ValueError("请求不是 multipart/form-data")
+        # 解析回调产生的事件：("begin", 文件名) / ("data", 字节) / ("end", None)
+        self._events = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._target = False
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+        self._finished = False
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._target = False
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if name == self.field and filename is not None and self.filename is None:
+            self._target = True
+            self._events.append(("begin", os.path.basename(filename.decode("utf-8", "replace"))))
+
+    def _on_part_data(self, data, start, end):
+        if self._target:
+            self._events.append(("data", bytes(data[start:end])))
+
+    def _on_part_end(self):
+        if self._target:
+            self._target = False
+            self._events.append(("end", None))
+
+    async def _next_event(self):
+        while not self._events:
+            if self._finished:
+                return None, None
+            try:
+                chunk = await self._stream.__anext__()
+            except StopAsyncIteration:
+                self._parser.finalize()
+                self._finished = True
+                continue
+            if chunk:
+                self._parser.write(chunk)
+        return self._events.pop(0)
+
+    async def begin(self):
+        """读到文件字段的头部为止，返回上传的文件名；请求中没有该字段时抛出 ValueError"""
+        while True:
+            kind, value = await self._next_event()
+            if kind is None:
+                raise ValueError(f"请求中缺少文件字段 {self.field!r}")
+            if kind == "begin":
+                self.filename = value
+                return value
+
+    async def chunks(self):
+        """逐块返回文件内容（需先调用 begin()）"""
+        while True:
+            kind, value = await self._next_event()
+            if kind == "data":
+                yield value
+            elif kind == "end":
+                return
+            else:
+                raise ValueError("上传的文件不完整")
+
+
+class AssetStore:
+    """
+    按内容去重的上传文件存储：
+    - 上传按块边写临时文件边计算 sha256，超过 max_bytes 立即中止（不再接收剩余的请求体）
+    - 相同内容只保存一份（文件名为内容哈希），重复上传返回已有文件并增加引用计数
+    - release() 减少引用计数，减到 0 才删除文件；生成任务执行期间通过 acquire() 持有引用
+    - 引用计数保存在 index_path（JSON），应位于上传目录之外
+    """
+
+    # 旧版本保存在上传目录下的索引文件名，启动时迁移到 index_path
+    INDEX_NAME = "refs.json"
+
+    def __init__(self, root, index_path, max_bytes=50 * 1024 ** 2, chunk_size=CHUNK_SIZE):
+        self.root = str(root)
+        self.index_path = str(index_path)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        self._migrate_index()
+        # 文件名 -> {"sha256", "size", "refs"}
+        self._index = self._load()
+
+    def _migrate_index(self):
+        legacy = os.path.join(self.root, self.INDEX_NAME)
+        if os.path.exists(legacy):
+            if not os.path.exists(self.index_path):
+                os.replace(legacy, self.index_path)
+            else:
+                os.remove(legacy)
+            logger.info(f"上传文件索引已移至 {self.index_path}")
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        path = self.index_path
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def name_of(self, path):
+        """路径（或文件名）在本存储中对应的文件名，不属于本存储时返回 None"""
+        name = os.path.basename(str(path))
+        if not name or name == self.INDEX_NAME or not os.path.exists(self.path(name)):
+            return None
+        return name
+
+    async def save(self, chunks, ext):
+        """
+        chunks 为逐块返回文件内容的异步迭代器（如 MultipartUpload.chunks()），ext 为扩展名（不含点）；
+        返回 (文件名, 是否为已有内容)，超过大小限制时立即停止读取并抛出 UploadTooLarge。
+        写文件和保存索引在线程中执行，不阻塞事件循环
+        """
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        tmp_path = os.path.join(self.root, f".upload-{uuid.uuid4().hex}.tmp")
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            try:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(self.max_bytes)
+                    digest.update(chunk)
+                    buffer += chunk
+                    # 攒够一块再写，避免每个网络分片都切换一次线程
+                    if len(buffer) >= self.chunk_size:
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(f.write, bytes(buffer))
+            finally:
+                await asyncio.to_thread(f.close)
+            name, duplicate = await asyncio.to_thread(self._commit, tmp_path, digest.hexdigest(), size, ext)
+        finally:
+            if os.path.exists(tmp_path):
+                await asyncio.to_thread(os.remove, tmp_path)
+        logger.info(f"上传文件 {name}（{size} 字节）{'与已有文件相同，引用计数 +1' if duplicate else '已保存'}")
+        return name, duplicate
+
+    def _commit(self, tmp_path, sha256, size, ext):
+        """临时文件写完后按内容哈希入库：已有相同内容时只增加引用计数"""
+        name = f"{sha256[:32]}.{ext}"
+        with self._lock:
+            entry = self._index.get(name)
+            duplicate = entry is not None and os.path.exists(self.path(name))
+            if duplicate:
+                entry["refs"] += 1
+            else:
+                os.replace(tmp_path, self.path(name))
+                self._index[name] = {"sha256": sha256, "size": size, "refs": 1}
+            self._save()
+        return name, duplicate
+
+    def acquire(self, names):
+        """为一组文件各增加一个引用（例如生成任务执行期间），返回实际持有引用的文件名"""
+        acquired = []
+        with self._lock:
+            for name in names:
+                entry = self._index.get(name)
+                if entry is not None:
+                    entry["refs"] += 1
+                    acquired.append(name)
+            if acquired:
+                self._save()
+        return acquired
+
+    def release(self, name):
+        """减少一个引用，引用计数为 0 时删除文件；返回文件是否已删除"""
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is not None:
+                entry["refs"] -= 1
+                if entry["refs"] > 0:
+                    self._save()
+                    return False
+                del self._index[name]
+                self._save()
+            # 不在索引中的旧文件（按随机名保存）只有一个使用者，直接删除
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+        logger.info(f"上传文件 {name} 已删除")
+        return True
+
+    def refs(self, name):
+        entry = self._index.get(name)
+        return entry["refs"] if entry else 0
@@ -0,0 +1,79 @@
+"""
+对比原 moviepy 合成与 StillVideoEncoder 的编码耗时：
+    python benchmarks/bench_encoder.py --scenes 6 --duration 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from frame_template import FRAME_SHAPE  # noqa: E402
+from video_encoder import StillVideoEncoder  # noqa: E402
+
+SAMPLE_RATE = 24000
+
+
+def make_scenes(count, duration):
+    """生成 count 个分镜：不同颜色的静态画面 + 时长在 duration 附近浮动的正弦旁白"""
+    rng = np.random.default_rng(0)
+    frames, audios = [], []
+    for i in range(count):
+        frame = np.full(FRAME_SHAPE, 255, dtype=np.uint8)
+        frame[500:1300, 140:940] = rng.integers(0, 256, 3, dtype=np.uint8)
+        frames.append(frame)
+        seconds = duration * rng.uniform(0.6, 1.4)
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        audios.append((0.3 * np.sin(2 * np.pi * (200 + 20 * i) * t)).astype(np.float32))
+    return frames, audios
+
+
+def encode_moviepy(frames, audios, output_path):
+    """原实现：ImageClip + AudioArrayClip 拼接后 write_videofile 逐帧编码"""
+    from moviepy.editor import ImageClip, concatenate_videoclips
+    from moviepy.audio.AudioClip import AudioArrayClip
+
+    clips = []
+    for frame, audio in zip(frames, audios):
+        audio_clip = AudioArrayClip(audio.reshape(-1, 1), fps=SAMPLE_RATE)
+        clips.append(ImageClip(frame).set_duration(audio_clip.duration).set_audio(audio_clip))
+    video = concatenate_videoclips(clips)
+    video.write_videofile(output_path, fps=24, codec="libx264", audio_codec="aac", threads=4,
+                          verbose=False, logger=None)
+
+
+def encode_still(frames, audios, output_path):
+    StillVideoEncoder().render(frames, audios, output_path, SAMPLE_RATE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频编码耗时对比")
+    parser.add_argument("--scenes", type=int, default=6, help="分镜数量")
+    parser.add_argument("--duration", type=float, default=8.0, help="每个分镜的平均时长（秒）")
+    parser.add_argument("--skip-moviepy", action="store_true", help="只测试 StillVideoEncoder")
+    args = parser.parse_args()
+
+    frames, audios = make_scenes(args.scenes, args.duration)
+    total = sum(len(audio) for audio in audios) / SAMPLE_RATE
+    print(f"{args.scenes} 个分镜，视频总时长 {total:.1f}s")
+
+    runners = [("still", encode_still)]
+    if not args.skip_moviepy:
+        runners.insert(0, ("moviepy", encode_moviepy))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, runner in runners:
+            output_path = os.path.join(tmp_dir, f"{name}.mp4")
+            start = time.perf_counter()
+            runner(frames, audios, output_path)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(output_path) / 1024 / 1024
+            print(f"{name:8s} {elapsed:7.2f}s  {total / elapsed:5.1f}x 实时  {size:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
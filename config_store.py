@@ -0,0 +1,451 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 编辑后延迟多久写盘：连续的多次编辑合并为一次写入
+DEFAULT_FLUSH_DELAY = 0.5
+
+
+class ConfigNotFound(Exception):
+    def __init__(self, name):
+        super().__init__(f"配置文件不存在: {name}")
+        self.name = name
+
+
+class ConfigExists(Exception):
+    def __init__(self, name):
+        super().__init__(f"配置文件已存在: {name}")
+        self.name = name
+
+
+class VersionConflict(Exception):
+    """乐观并发控制：客户端基于的版本已被其他修改覆盖"""
+
+    def __init__(self, name, expected, current):
+        super().__init__(f"配置 {name} 已被修改（当前版本 {current}，请求基于版本 {expected}），请重新加载后再编辑")
+        self.expected = expected
+        self.current = current
+
+
+class PatchError(ValueError):
+    """JSON Patch 无法应用（路径不存在、操作无效等）"""
+
+
+class PatchConflict(PatchError):
+    """JSON Patch 的 test 操作不成立"""
+
+
+def _parse_pointer(pointer):
+    """JSON Pointer（RFC 6901）拆分为路径片段"""
+    if pointer == "":
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise PatchError(f"无效的路径: {pointer!r}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer[1:].split("/")]
+
+
+def _list_index(container, part, allow_end=False):
+    if allow_end and part == "-":
+        return len(container)
+    if not part.isdigit() or (len(part) > 1 and part.startswith("0")):
+        raise PatchError(f"无效的数组下标: {part!r}")
+    index = int(part)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"数组下标越界: {index}")
+    return index
+
+
+def _resolve(doc, parts):
+    """返回路径上的值"""
+    for part in parts:
+        if isinstance(doc, dict):
+            if part not in doc:
+                raise PatchError(f"路径不存在: {part!r}")
+            doc = doc[part]
+        elif isinstance(doc, list):
+            doc = doc[_list_index(doc, part)]
+        else:
+            raise PatchError(f"路径不存在: {part!r}")
+    return doc
+
+
+def _add(doc, parts, value, undo):
+    """添加或覆盖一个节点，把撤销操作记入 undo；路径为空时替换整个文档"""
+    if not parts:
+        undo.append(lambda: None)
+        return value
+    parent = _resolve(doc, parts[:-1])
+    key = parts[-1]
+    if isinstance(parent, dict):
+        if key in parent:
+            old = parent[key]
+            undo.append(lambda: parent.__setitem__(key, old))
+        else:
+            undo.append(lambda: parent.pop(key))
+        parent[key] = value
+    elif isinstance(parent, list):
+        index = _list_index(parent, key, allow_end=True)
+        parent.insert(index, value)
+        undo.append(lambda: parent.pop(index))
+    else:
+        raise PatchError(f"无法在非容器上添加: {key!r}")
+    return doc
+
+
+def _remove(doc, parts, undo):
+    """删除一个节点并返回其值，把撤销操作记入 undo"""
+    if not parts:
+        raise PatchError("不能删除整个文档")
+    parent = _resolve(doc, parts[:-1])
+    key = parts[-1]
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise PatchError(f"路径不存在: {key!r}")
+        value = parent.pop(key)
+        undo.append(lambda: parent.__setitem__(key, value))
+        return value
+    if isinstance(parent, list):
+        index = _list_index(parent, key)
+        value = parent.pop(index)
+        undo.append(lambda: parent.insert(index, value))
+        return value
+    raise PatchError(f"路径不存在: {key!r}")
+
+
+def apply_patch(doc, operations):
+    """
+    按 JSON Patch（RFC 6902）修改文档，支持 add / remove / replace / move / copy / test：
+    直接在原文档上修改（只复制补丁中的值，不复制整个文档），并记录每一步的撤销操作，
+    任一操作失败时按相反顺序撤销后抛出 PatchError，文档恢复原状；返回修改后的文档（路径为空时是新的根）
+    """
+    if not isinstance(operations, list):
+        raise PatchError("JSON Patch 必须是操作列表")
+    undo = []
+    try:
+        for operation in operations:
+            if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+                raise PatchError(f"无效的操作: {operation!r}")
+            op = operation["op"]
+            parts = _parse_pointer(operation["path"])
+            if op in ("add", "replace", "test") and "value" not in operation:
+                raise PatchError(f"{op} 操作缺少 value")
+            if op == "add":
+                doc = _add(doc, parts, copy.deepcopy(operation["value"]), undo)
+            elif op == "remove":
+                _remove(doc, parts, undo)
+            elif op == "replace":
+                if parts:
+                    _remove(doc, parts, undo)
+                doc = _add(doc, parts, copy.deepcopy(operation["value"]), undo)
+            elif op in ("move", "copy"):
+                source = _parse_pointer(operation.get("from"))
+                if op == "move":
+                    if parts[:len(source)] == source and parts != source:
+                        raise PatchError("不能把节点移动到自身内部")
+                    value = _remove(doc, source, undo)
+                else:
+                    value = copy.deepcopy(_resolve(doc, source))
+                doc = _add(doc, parts, value, undo)
+            elif op == "test":
+                if _resolve(doc, parts) != operation["value"]:
+                    raise PatchConflict(f"test 不成立: {operation['path']}")
+            else:
+                raise PatchError(f"不支持的操作: {op!r}")
+    except BaseException:
+        for step in reversed(undo):
+            step()
+        raise
+    return doc
+
+
+class _Entry:
+    def __init__(self):
+        # 每个配置文件一把锁：同一文件的编辑串行执行，不同文件互不影响
+        self.lock = threading.Lock()
+        self.data = None
+        self.version = 0
+        # 最近一次读取或写入后磁盘文件的修改时间，用于发现外部修改
+        self.mtime_ns = None
+        self.dirty = False
+        # 删除已写盘、缓存项已从 ConfigStore 中移除
+        self.removed = False
+
+
+class ConfigStore:
+    """
+    分镜配置存储：
+    - 解析后的配置常驻内存，读取和编辑不再每次读写整个 JSON 文件
+    - 每次编辑版本号加 1，调用方传入 expected_version 时版本不一致抛出 VersionConflict（乐观并发）
+    - 编辑只修改内存并标记待写，后台线程延迟 flush_delay 秒后写临时文件再 rename，
+      连续编辑合并为一次写入，写到一半崩溃也不会留下损坏的配置
+    - 内存中没有未写入的修改时，磁盘文件被外部改动会重新加载（版本号随之增加）
+    on_change(文件名, 新内容) 在配置被创建、修改、重新加载或删除（新内容为 None）后由后台线程在文件锁外调用，
+    新内容是副本；同一配置的连续修改只通知最新的内容，回调较慢（例如写索引）时也不会阻塞编辑
+    """
+
+    def __init__(self, root, flush_delay=None, on_change=None):
+        self.root = str(root)
+        self.flush_delay = DEFAULT_FLUSH_DELAY if flush_delay is None else flush_delay
+        self.on_change = on_change
+        self._entries = {}
+        self._lock = threading.Lock()
+        # 文件名 -> 计划写盘时间
+        self._pending = {}
+        # 待通知 on_change 的文件名
+        self._changes = set()
+        self._notify_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        os.makedirs(self.root, exist_ok=True)
+        self._writer = threading.Thread(target=self._write_loop, name="config-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def check_name(name):
+        if not name or os.path.basename(name) != name or not name.endswith(".json") or name.startswith("."):
+            raise ValueError(f"无效的配置文件名: {name!r}")
+        return name
+
+    def path(self, name):
+        return os.path.join(self.root, self.check_name(name))
+
+    @contextmanager
+    def _locked(self, name, create=False):
+        """
+        取得配置的缓存项并持有其文件锁，没有未写盘的修改时先与磁盘核对；
+        只为已存在或正在创建（create 为真）的配置建缓存项，否则抛出 ConfigNotFound
+        """
+        path = self.path(name)
+        while True:
+            with self._lock:
+                entry = self._entries.get(name)
+            if entry is None:
+                if not create and not os.path.exists(path):
+                    raise ConfigNotFound(name)
+                with self._lock:
+                    entry = self._entries.setdefault(name, _Entry())
+            with entry.lock:
+                if entry.removed:
+                    # 等锁期间缓存项已被移除，重新获取
+                    continue
+                try:
+                    if not entry.dirty:
+                        self._reload(name, entry, path)
+                    yield entry
+                finally:
+                    if entry.data is None and not entry.dirty:
+                        self._discard(name, entry)
+                return
+
+    def _discard(self, name, entry):
+        """移除已不存在的配置的缓存项（调用方持有 entry.lock）"""
+        with self._lock:
+            if self._entries.get(name) is entry:
+                del self._entries[name]
+        entry.removed = True
+
+    def _reload(self, name, entry, path):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns == entry.mtime_ns:
+            return
+        data = None
+        if mtime_ns is not None:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        entry.data = data
+        entry.mtime_ns = mtime_ns
+        entry.version += 1
+        logger.info(f"加载配置 {name}（版本 {entry.version}）")
+        if entry.version > 1:
+            # 首次加载之后磁盘文件被外部修改
+            self._changed(name)
+
+    def _changed(self, name):
+        """记下需要通知的配置，由后台线程调用 on_change（调用方可能持有文件锁）"""
+        if self.on_change is None:
+            return
+        with self._lock:
+            self._changes.add(name)
+            self._wakeup.notify()
+
+    def _notify_changes(self):
+        # 后台线程和 flush() 可能同时通知，串行执行，保证同一配置的通知不会乱序
+        with self._notify_lock:
+            with self._lock:
+                names = list(self._changes)
+                self._changes.clear()
+            for name in names:
+                with self._lock:
+                    entry = self._entries.get(name)
+                data = None
+                if entry is not None:
+                    # 只在锁内复制，回调在锁外执行
+                    with entry.lock:
+                        data = copy.deepcopy(entry.data)
+                try:
+                    self.on_change(name, data)
+                except Exception as e:
+                    logger.error(f"配置 {name} 变更回调失败: {e}", exc_info=True)
+
+    def names(self):
+        """已有的配置文件名（含尚未写盘的新配置，不含尚未从磁盘删除的配置）"""
+        names = {name for name in os.listdir(self.root) if name.endswith(".json") and not name.startswith(".")}
+        with self._lock:
+            entries = list(self._entries.items())
+        for name, entry in entries:
+            if entry.dirty:
+                if entry.data is None:
+                    names.discard(name)
+                else:
+                    names.add(name)
+        return sorted(names)
+
+    def get(self, name):
+        """返回 (配置副本, 版本号)"""
+        with self._locked(name) as entry:
+            if entry.data is None:
+                raise ConfigNotFound(name)
+            return copy.deepcopy(entry.data), entry.version
+
+    def create(self, name, data):
+        with self._locked(name, create=True) as entry:
+            if entry.data is not None:
+                raise ConfigExists(name)
+            return self._commit(name, entry, data)
+
+    def update(self, name, edit, expected_version=None):
+        """
+        在文件锁内执行 edit(data)：edit 可以原地修改 data 并返回结果，
+        返回 (edit 的返回值, 新版本号)；edit 抛出异常时应保证未修改 data
+        """
+        with self._locked(name) as entry:
+            self._check(name, entry, expected_version)
+            result = edit(entry.data)
+            return result, self._commit(name, entry, entry.data)
+
+    def replace(self, name, data, expected_version=None):
+        """整体替换配置，返回新版本号"""
+        with self._locked(name) as entry:
+            self._check(name, entry, expected_version)
+            return self._commit(name, entry, data)
+
+    def patch(self, name, operations, expected_version=None):
+        """应用 JSON Patch，返回新版本号；补丁作为整体生效，任一操作失败时配置不变"""
+        with self._locked(name) as entry:
+            self._check(name, entry, expected_version)
+            return self._commit(name, entry, apply_patch(entry.data, operations))
+
+    def delete(self, name):
+        with self._locked(name) as entry:
+            if entry.data is None:
+                raise ConfigNotFound(name)
+            self._commit(name, entry, None)
+
+    def _check(self, name, entry, expected_version):
+        if entry.data is None:
+            raise ConfigNotFound(name)
+        if expected_version is not None and expected_version != entry.version:
+            raise VersionConflict(name, expected_version, entry.version)
+
+    def _commit(self, name, entry, data):
+        entry.data = data
+        entry.version += 1
+        entry.dirty = True
+        self._changed(name)
+        with self._lock:
+            self._pending.setdefault(name, time.monotonic() + self.flush_delay)
+            self._wakeup.notify()
+        return entry.version
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    now = time.monotonic()
+                    due = [name for name, at in self._pending.items() if at <= now]
+                    if due or self._changes:
+                        break
+                    self._wakeup.wait(min(self._pending.values()) - now if self._pending else None)
+                else:
+                    return
+                for name in due:
+                    del self._pending[name]
+            self._notify_changes()
+            for name in due:
+                self._write(name)
+
+    def _write(self, name):
+        """写入一个配置：在锁内序列化，锁外写临时文件，再在锁内 rename 替换"""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            return
+        path = self.path(name)
+        tmp_path = None
+        try:
+            with entry.lock:
+                if not entry.dirty:
+                    return
+                version = entry.version
+                text = None if entry.data is None else json.dumps(entry.data, ensure_ascii=False, indent=2)
+            if text is not None:
+                tmp_path = os.path.join(self.root, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+            with entry.lock:
+                if entry.version != version:
+                    # 序列化之后又有新的编辑，留给下一次写入
+                    return
+                if text is None:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    entry.mtime_ns = None
+                    self._discard(name, entry)
+                else:
+                    os.replace(tmp_path, path)
+                    tmp_path = None
+                    entry.mtime_ns = os.stat(path).st_mtime_ns
+                entry.dirty = False
+            logger.info(f"配置 {name} 已写入（版本 {version}）")
+        except Exception as e:
+            logger.error(f"写入配置 {name} 失败: {e}", exc_info=True)
+            with self._lock:
+                self._pending.setdefault(name, time.monotonic() + max(self.flush_delay, 1.0))
+                self._wakeup.notify()
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def flush(self):
+        """立即通知所有变更并写入所有未写盘的修改"""
+        self._notify_changes()
+        with self._lock:
+            names = list(self._pending)
+            self._pending.clear()
+        for name in names:
+            self._write(name)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join()
+        self.flush()
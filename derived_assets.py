@@ -0,0 +1,104 @@
+import hashlib
+import io
+import json
+import logging
+import os
+
+from PIL import Image
+
+from disk_cache import DiskCache, image_digest
+
+logger = logging.getLogger(__name__)
+
+# 预览缩略图的最长边
+THUMBNAIL_SIZE = (400, 400)
+# 派生图格式版本：解码或缩放方式变化时递增
+DERIVED_VERSION = 1
+DEFAULT_DERIVED_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "derived")
+
+_default_cache = None
+
+
+def decode_image(path, target_size):
+    """
+    解码图片：JPEG 使用 draft 模式直接按 1/2、1/4、1/8 缩小解码（不小于 target_size），
+    手机拍摄的大图不必完整解码；GIF 等多帧图片取第一帧
+    """
+    img = Image.open(path)
+    if img.format == "JPEG":
+        img.draft("RGB", target_size)
+    return img
+
+
+class DerivedAssetCache(DiskCache):
+    """
+    源图片的派生图缓存，key 为 (源图片内容哈希, 派生类型, 尺寸, 版本)：
+    - illustration：指定尺寸的 RGBA 原始像素（.rgba），渲染时直接 frombuffer，无需解码和缩放
+    - thumbnail：最长边不超过 THUMBNAIL_SIZE 的 JPEG 预览图
+    """
+
+    label = "派生图缓存"
+    probe_exts = (".rgba", ".jpg")
+
+    def __init__(self, root=DEFAULT_DERIVED_CACHE_DIR, max_bytes=2 * 1024 ** 3, scan=True):
+        super().__init__(root, max_bytes=max_bytes, scan=scan)
+
+    @staticmethod
+    def make_key(path, kind, size):
+        digest = image_digest(path)
+        if digest.startswith("missing:"):
+            raise FileNotFoundError(path)
+        data = json.dumps([digest, kind, list(size), DERIVED_VERSION])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def illustration(self, path, size):
+        """返回 size 大小的 RGBA 插画；首次使用时解码、缩放并写入缓存"""
+        key = self.make_key(path, "illustration", size)
+        cached = self.get(key)
+        if cached is not None:
+            with open(cached, "rb") as f:
+                data = f.read()
+            if len(data) == size[0] * size[1] * 4:
+                return Image.frombuffer("RGBA", size, data, "raw", "RGBA", 0, 1)
+        img = decode_image(path, size).convert("RGBA").resize(size)
+        self.put(key, img.tobytes(), ext=".rgba")
+        return img
+
+    def thumbnail(self, path, size=THUMBNAIL_SIZE):
+        """返回缩略图文件路径；首次使用时生成"""
+        key = self.make_key(path, "thumbnail", size)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        img = decode_image(path, size)
+        img.thumbnail(size)
+        if img.mode in ("RGBA", "LA", "P"):
+            # 透明背景铺白色后再存为 JPEG
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            rgba = img.convert("RGBA")
+            background.paste(rgba, mask=rgba)
+            img = background
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, format="JPEG", quality=85)
+        return self.put(key, buffer.getvalue(), ext=".jpg")
+
+    def prepare(self, path, illustration_size):
+        """预先生成插画和缩略图（上传完成后在后台调用），失败时只记录日志"""
+        try:
+            self.illustration(path, illustration_size)
+            self.thumbnail(path)
+        except Exception as e:
+            logger.warning(f"生成派生图失败 {path}: {e}")
+
+
+def get_derived_cache(scan=True):
+    """
+    进程内共用的派生图缓存，目录和容量可由 DERIVED_CACHE_DIR / DERIVED_CACHE_MAX_MB 配置；
+    scan=False（帧渲染进程）时首次创建不扫描整个缓存目录，只按内容哈希的 key 直接查找
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DerivedAssetCache(os.getenv("DERIVED_CACHE_DIR", DEFAULT_DERIVED_CACHE_DIR),
+                                           max_bytes=int(os.getenv("DERIVED_CACHE_MAX_MB", "2048")) * 1024 ** 2,
+                                           scan=scan)
+    return _default_cache
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=256)
+def _file_digest(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_digest(image):
+    """图片内容的哈希（片段缓存和派生图片共用）：同一文件未修改时只计算一次；文件不存在时退化为路径本身"""
+    try:
+        stat = os.stat(image)
+    except (OSError, TypeError, ValueError):
+        return f"missing:{image}"
+    return _file_digest(os.path.abspath(image), stat.st_mtime_ns, stat.st_size)
+
+
+class DiskCache:
+    """
+    按 key 寻址的磁盘缓存，图片缓存和语音缓存共用：
+    - 文件按 key 前两位分片存放：root/ab/abcdef....ext
+    - 可选的同名附属文件（sidecar_ext，例如 .json 元数据）随主文件一起计数和淘汰
+    - 总大小超过 max_bytes 时按最近访问时间淘汰（LRU）
+    - scan=False 时启动不扫描缓存目录，只按 key 直接探测磁盘（需设置 probe_exts），适合短命的工作进程；
+      此时容量统计只包含本进程写入或命中过的文件，整体的淘汰由扫描过目录的进程负责
+    """
+
+    # 日志中显示的缓存名称
+    label = "缓存"
+    # 索引中找不到时按这些扩展名直接探测磁盘，便于多个进程共用同一个缓存目录
+    probe_exts = ()
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, sidecar_ext=None, scan=True):
+        self.root = str(root)
+        self.sidecar_ext = sidecar_ext
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # key -> (路径, 大小)，按最近访问时间从旧到新排列
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+        if scan:
+            self._scan()
+
+    # 启动时扫描已有缓存文件，按修改时间恢复 LRU 顺序
+    def _scan(self):
+        found = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                if self.sidecar_ext and entry.name.endswith(self.sidecar_ext):
+                    continue
+                stat = entry.stat()
+                found.append((stat.st_mtime, os.path.splitext(entry.name)[0], entry.path,
+                              stat.st_size + self._sidecar_size(entry.path)))
+        for _, key, path, size in sorted(found):
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+
+    def _path_for(self, key, ext):
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def sidecar_path(self, path):
+        return os.path.splitext(path)[0] + self.sidecar_ext
+
+    def _sidecar_size(self, path):
+        if not self.sidecar_ext:
+            return 0
+        try:
+            return os.path.getsize(self.sidecar_path(path))
+        except OSError:
+            return 0
+
+    # 命中时返回缓存文件路径并刷新访问时间，否则返回 None
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            for ext in self.probe_exts:
+                path = self._path_for(key, ext)
+                if os.path.exists(path):
+                    entry = (path, os.path.getsize(path) + self._sidecar_size(path))
+                    self._entries[key] = entry
+                    self._total_bytes += entry[1]
+                    break
+        if entry is None or not os.path.exists(entry[0]):
+            if entry is not None:
+                self._forget(key)
+            self.misses += 1
+            logger.info(f"{self.label}未命中 {key[:12]} (命中 {self.hits} / 未命中 {self.misses})")
+            return None
+        self._entries.move_to_end(key)
+        os.utime(entry[0])
+        self.hits += 1
+        logger.info(f"{self.label}命中 {key[:12]} (命中 {self.hits} / 未命中 {self.misses})")
+        return entry[0]
+
+    # 原子写入：先写临时文件再改名，避免读到写了一半的缓存
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, key, data, ext=".png", sidecar=None):
+        path = self._path_for(key, ext)
+        if sidecar is not None:
+            self._write_atomic(self.sidecar_path(path), sidecar)
+        self._write_atomic(path, data)
+        self._add(key, path, len(data) + (len(sidecar) if sidecar is not None else 0))
+        return path
+
+    def put_file(self, key, src_path, sidecar=None, move=False):
+        """move=True 时直接把 src_path 移入缓存（需与缓存目录在同一文件系统），否则复制"""
+        ext = os.path.splitext(src_path)[1] or ".png"
+        path = self._path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if sidecar is not None:
+            self._write_atomic(self.sidecar_path(path), sidecar)
+        if move:
+            os.replace(src_path, path)
+        else:
+            tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, path)
+        self._add(key, path, os.path.getsize(path) + (len(sidecar) if sidecar is not None else 0))
+        return path
+
+    def _add(self, key, path, size):
+        if key in self._entries:
+            self._forget(key)
+        self._entries[key] = (path, size)
+        self._total_bytes += size
+        self._evict()
+
+    def _forget(self, key):
+        _, size = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (path, _) = next(iter(self._entries.items()))
+            self._forget(key)
+            paths = [path, self.sidecar_path(path)] if self.sidecar_ext else [path]
+            for stale in paths:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            logger.debug(f"{self.label}淘汰 {key[:12]}")
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+        }
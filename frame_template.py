@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from derived_assets import get_derived_cache
+from text_layout import wrap_text
+
+logger = logging.getLogger(__name__)
+
+# 竖屏画布尺寸与插画尺寸
+CANVAS_SIZE = (1080, 1920)
+ILLUSTRATION_SIZE = (800, 800)
+# 字幕最大行宽
+SUBTITLE_MAX_WIDTH = 1000
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255, 255)
+# 交给视频合成的帧：(高, 宽, 3) 的 uint8 RGB 数组
+FRAME_SHAPE = (CANVAS_SIZE[1], CANVAS_SIZE[0], 3)
+FRAME_BYTES = FRAME_SHAPE[0] * FRAME_SHAPE[1] * FRAME_SHAPE[2]
+# 帧默认只在内存中交给视频合成，SAVE_FRAMES=true 时额外保存 PNG 便于调试
+SAVE_FRAMES = os.getenv("SAVE_FRAMES", "false").lower() == "true"
+
+
+@lru_cache(maxsize=64)
+def load_font(path, size):
+    """按 (字体路径, 字号) 缓存字体，每个进程只加载一次；加载失败时使用 Pillow 默认字体"""
+    try:
+        return ImageFont.truetype(str(path), size)
+    except OSError:
+        logger.warning(f"无法加载字体 {path}，使用备用字体")
+        return ImageFont.load_default()
+
+
+def open_illustration(image, placeholder_text="图片加载失败", placeholder_color=(200, 200, 200)):
+    """
+    把插画（路径、BytesIO 或 PIL.Image）缩放为 ILLUSTRATION_SIZE 的 RGBA 图；加载失败时返回占位图
+    路径形式的插画从派生图缓存读取已缩放好的像素，同一张图只解码、缩放一次
+    """
+    try:
+        if isinstance(image, (str, os.PathLike)):
+            # 渲染进程只查找这一张图的 key，不扫描整个派生图缓存目录
+            return get_derived_cache(scan=False).illustration(image, ILLUSTRATION_SIZE)
+        img = image if isinstance(image, Image.Image) else Image.open(image)
+        return img.convert('RGBA').resize(ILLUSTRATION_SIZE)
+    except Exception as e:
+        logger.warning(f"无法加载图片: {str(e)}")
+        placeholder = Image.new("RGBA", ILLUSTRATION_SIZE, placeholder_color)
+        ImageDraw.Draw(placeholder).text((300, 300), placeholder_text, fill=BLACK)
+        return placeholder
+
+
+class FrameTemplate:
+    """
+    一个视频任务的帧模板：
+    - 白色背景、左上角“本期主题：…”、分隔线等每帧相同的内容只绘制一次（base）
+    - 每个分镜帧复制 base 后只绘制插画、标题和字幕
+    """
+
+    def __init__(self, theme, font_path="msyh.ttc", divider_y=None, header_pos=(50, 30), header_size=36,
+                 title_size=52, zh_size=40, en_size=26):
+        self.theme = theme
+        self.font_path = str(font_path)
+        self.divider_y = divider_y
+        self.header_pos = header_pos
+        self.header_size = header_size
+        self.title_size = title_size
+        self.zh_size = zh_size
+        self.en_size = en_size
+        self._base = None
+
+    def spec(self):
+        """模板参数（可在进程间传递），worker 进程据此重建模板"""
+        return {
+            "theme": self.theme, "font_path": self.font_path, "divider_y": self.divider_y,
+            "header_pos": self.header_pos, "header_size": self.header_size, "title_size": self.title_size,
+            "zh_size": self.zh_size, "en_size": self.en_size,
+        }
+
+    def font(self, size):
+        return load_font(self.font_path, size)
+
+    @property
+    def base(self):
+        if self._base is None:
+            base = Image.new("RGBA", CANVAS_SIZE, WHITE)
+            draw = ImageDraw.Draw(base)
+            draw.text(self.header_pos, f"本期主题：{self.theme}", fill=BLACK, font=self.font(self.header_size))
+            if self.divider_y is not None:
+                draw.line([(0, self.divider_y), (CANVAS_SIZE[0], self.divider_y)], fill=BLACK, width=5)
+            self._base = base
+        return self._base
+
+    def _draw_centered(self, draw, text, y, font):
+        bbox = draw.textbbox((0, 0), text, font=font)
+        draw.text(((CANVAS_SIZE[0] - (bbox[2] - bbox[0])) // 2, y), text, fill=BLACK, font=font)
+
+    def render_scene(self, image, title, zh_text, en_text, en_min_y=None):
+        """
+        绘制分镜帧：插画 (140, 500)，标题居中于 y=90，中文字幕从 y=1400 起逐行居中，英文字幕紧随其后
+        en_min_y 指定英文字幕的最小起始高度
+        """
+        frame = self.base.copy()
+        fg = open_illustration(image)
+        frame.paste(fg, (140, 500), fg)
+        draw = ImageDraw.Draw(frame)
+
+        self._draw_centered(draw, title, 90, self.font(self.title_size))
+
+        zh_font = self.font(self.zh_size)
+        zh_y = 1400
+        for line in wrap_text(zh_text, zh_font, SUBTITLE_MAX_WIDTH):
+            self._draw_centered(draw, line, zh_y, zh_font)
+            zh_y += 50
+
+        en_font = self.font(self.en_size)
+        en_y = zh_y + 20 if en_min_y is None else max(en_min_y, zh_y + 30)
+        for line in wrap_text(en_text, en_font, SUBTITLE_MAX_WIDTH):
+            self._draw_centered(draw, line, en_y, en_font)
+            en_y += 30
+        return frame
+
+    def render_cover(self, image, title=None, header_size=40, title_size=80):
+        """绘制封面帧：插画在下半部分 (140, 960)，主题在左上角，可选的大标题居中于 y=350"""
+        frame = Image.new("RGBA", CANVAS_SIZE, WHITE)
+        fg = open_illustration(image, "封面图片加载失败", (150, 150, 150))
+        frame.paste(fg, (140, 960), fg)
+        draw = ImageDraw.Draw(frame)
+        draw.text((50, 50), f"本期主题：{self.theme}", fill=BLACK, font=self.font(header_size))
+        if title:
+            self._draw_centered(draw, title, 350, self.font(title_size))
+        return frame
+
+
+# worker 进程内的模板缓存：同一任务的分镜在同一进程中只绘制一次 base
+_worker_templates = {}
+_WORKER_TEMPLATE_LIMIT = 8
+
+
+def _warm_fonts(font_path, sizes):
+    for size in sizes:
+        load_font(font_path, size)
+
+
+def _worker_template(spec):
+    key = tuple(sorted(spec.items()))
+    template = _worker_templates.get(key)
+    if template is None:
+        if len(_worker_templates) >= _WORKER_TEMPLATE_LIMIT:
+            _worker_templates.clear()
+        template = _worker_templates[key] = FrameTemplate(**spec)
+    return template
+
+
+def render_frame(spec, kind, image, output_path, options, shm_name=None, slot=0):
+    """
+    在 worker 进程中绘制一帧（kind 为 "cover" 或 "scene"），返回 RGB 数组；
+    指定 shm_name 时直接写入父进程共享内存的第 slot 帧，不再经管道传回；
+    output_path 不为空时额外保存 PNG（调试用）
+    """
+    template = _worker_template(spec)
+    if kind == "cover":
+        frame = template.render_cover(image, **options)
+    else:
+        frame = template.render_scene(image, **options)
+    frame = frame.convert("RGB")
+    if output_path:
+        frame.save(str(output_path))
+    if shm_name is None:
+        return np.asarray(frame)
+
+    # worker 与父进程共用 resource_tracker，附加已有共享内存不会造成重复清理
+    shm = SharedMemory(name=shm_name)
+    try:
+        target = np.ndarray(FRAME_SHAPE, dtype=np.uint8, buffer=shm.buf, offset=slot * FRAME_BYTES)
+        target[:] = np.asarray(frame)
+        del target
+    finally:
+        shm.close()
+    return None
+
+
+class FrameBatch:
+    """
+    一批渲染好的帧，frames[i] 为 FRAME_SHAPE 的 RGB 数组，可直接交给 ImageClip；
+    使用共享内存时各帧是共享内存上的视图，视频写完后调用 close() 释放
+    """
+
+    def __init__(self, frames=None, shm=None):
+        self._shm = shm
+        if shm is not None:
+            count = shm.size // FRAME_BYTES
+            self._frames = list(np.ndarray((count, *FRAME_SHAPE), dtype=np.uint8, buffer=shm.buf))
+        else:
+            self._frames = list(frames or [])
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __getitem__(self, index):
+        return self._frames[index]
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def close(self):
+        self._frames = []
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # 仍有 clip 引用这些帧时只能先取消链接，内存随最后一个引用释放
+                pass
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameRenderer:
+    """
+    帧渲染进程池：
+    - worker 启动时预先加载模板用到的字体
+    - render() 把所有帧一次性分发到进程池，按提交顺序（即分镜顺序）返回 RGB 数组，不经过 PNG 编解码
+    - shared_memory=True（或 FRAME_SHARED_MEMORY=true）时帧直接写入父进程分配的共享内存，不经管道复制
+    - 进程数由 max_workers 或 FRAME_WORKERS 配置，默认 CPU 核数
+    """
+
+    def __init__(self, max_workers=None, font_path="msyh.ttc", font_sizes=(36, 40, 52, 26, 80), shared_memory=None):
+        self.max_workers = max_workers or int(os.getenv("FRAME_WORKERS", "0")) or os.cpu_count()
+        self.font_path = str(font_path)
+        self.font_sizes = tuple(font_sizes)
+        if shared_memory is None:
+            shared_memory = os.getenv("FRAME_SHARED_MEMORY", "false").lower() == "true"
+        self.shared_memory = shared_memory
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_warm_fonts,
+                                             initargs=(self.font_path, self.font_sizes))
+        return self._pool
+
+    def _submit(self, template, jobs):
+        spec = template.spec()
+        shm = None
+        if self.shared_memory and jobs:
+            shm = SharedMemory(create=True, size=len(jobs) * FRAME_BYTES)
+        futures = [self.pool.submit(render_frame, spec, kind, image, output_path, options,
+                                    shm.name if shm else None, slot)
+                   for slot, (kind, image, output_path, options) in enumerate(jobs)]
+        return futures, shm
+
+    @staticmethod
+    def _collect(results, shm):
+        return FrameBatch(shm=shm) if shm is not None else FrameBatch(results)
+
+    def render(self, template, jobs):
+        """
+        jobs 为 [(kind, 插画, PNG 路径或 None, 绘制参数)]，绘制参数传给 render_cover / render_scene；
+        阻塞直到全部完成，返回按 jobs 顺序排列的 FrameBatch
+        """
+        futures, shm = self._submit(template, jobs)
+        try:
+            return self._collect([future.result() for future in futures], shm)
+        except BaseException:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            raise
+
+    async def render_async(self, template, jobs, progress=None):
+        """与 render() 相同，但不阻塞事件循环；progress(已完成帧数, 总帧数) 在每帧完成时调用"""
+        futures, shm = self._submit(template, jobs)
+        try:
+            waiters = [asyncio.wrap_future(future) for future in futures]
+            if progress is not None:
+                for done, waiter in enumerate(asyncio.as_completed(waiters), 1):
+                    await waiter
+                    progress(done, len(waiters))
+            return self._collect(await asyncio.gather(*waiters), shm)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            raise
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,20 @@
+import hashlib
+import json
+
+from disk_cache import DiskCache
+
+
+class ImageCache(DiskCache):
+    """
+    按内容寻址的生成图片缓存：
+    - key 为提交给 ComfyUI 的完整 prompt 的哈希（包含工作流内容、正/负向提示词、种子、分辨率）
+    - 文件按 key 前两位分片存放：root/ab/abcdef....png
+    - 总大小超过 max_bytes 时按最近访问时间淘汰（LRU）
+    """
+
+    label = "图片缓存"
+
+    @staticmethod
+    def make_key(prompt_workflow):
+        data = json.dumps(prompt_workflow, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
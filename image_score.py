@@ -0,0 +1,50 @@
+import numpy as np
+
+# 打分前统一缩放到的边长，降低计算量
+SCORE_SIZE = 256
+# 理想的墨迹（深色像素）占比及容差：太少是空白图，太多是杂乱图
+INK_TARGET = 0.06
+INK_TOLERANCE = 0.06
+# 理想的边缘像素占比及容差：太多说明画面杂乱
+EDGE_TARGET = 0.04
+EDGE_TOLERANCE = 0.04
+# 各项指标权重
+WEIGHTS = {"whiteness": 0.4, "ink": 0.25, "clean": 0.2, "edges": 0.15}
+
+
+def score_candidates(images):
+    """
+    对同一分镜的多张候选图批量打分（“白底简笔画”风格，分数越高越好），返回与 images 对应的指标列表：
+    - whiteness：四周边框区域接近纯白的比例
+    - ink：深色线条占比，越接近 INK_TARGET 得分越高
+    - clean：1 - 中间灰度像素占比，灰蒙蒙的图得分低
+    - edges：边缘像素占比，越接近 EDGE_TARGET 得分越高
+    """
+    gray = np.stack([
+        np.asarray(img.convert("L").resize((SCORE_SIZE, SCORE_SIZE)), dtype=np.float32) / 255.0
+        for img in images
+    ])
+
+    band = SCORE_SIZE // 12
+    border = np.zeros((SCORE_SIZE, SCORE_SIZE), dtype=bool)
+    border[:band, :] = border[-band:, :] = True
+    border[:, :band] = border[:, -band:] = True
+
+    whiteness = (gray[:, border] > 0.92).mean(axis=1)
+    ink = (gray < 0.4).mean(axis=(1, 2))
+    midtone = ((gray >= 0.4) & (gray <= 0.85)).mean(axis=(1, 2))
+    gradient = np.abs(np.diff(gray, axis=2))[:, :-1, :] + np.abs(np.diff(gray, axis=1))[:, :, :-1]
+    edges = (gradient > 0.25).mean(axis=(1, 2))
+
+    ink_score = np.exp(-((ink - INK_TARGET) / INK_TOLERANCE) ** 2)
+    edge_score = np.exp(-((edges - EDGE_TARGET) / EDGE_TOLERANCE) ** 2)
+    total = (WEIGHTS["whiteness"] * whiteness + WEIGHTS["ink"] * ink_score
+             + WEIGHTS["clean"] * (1 - midtone) + WEIGHTS["edges"] * edge_score)
+
+    return [{
+        "score": round(float(total[i]), 4),
+        "whiteness": round(float(whiteness[i]), 4),
+        "ink": round(float(ink[i]), 4),
+        "midtone": round(float(midtone[i]), 4),
+        "edges": round(float(edges[i]), 4),
+    } for i in range(len(images))]
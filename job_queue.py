@@ -0,0 +1,365 @@
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+# 各任务的独立工作目录默认放在项目根目录的 cache/jobs/<进程>/ 下，任务结束（成功、失败或取消）后删除；
+# 每个服务进程使用自己的子目录，多个 uvicorn worker 共用同一个根目录时互不影响
+DEFAULT_WORKSPACE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "jobs")
+
+
+class JobCancelled(Exception):
+    """任务被取消：任务进程内的 report() 在取消后抛出，流程据此提前结束并清理"""
+
+
+class Job:
+    """一个后台任务的状态；所有修改都在事件循环线程中进行，变化时唤醒订阅者"""
+
+    def __init__(self, payload):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = QUEUED
+        self.stage = None
+        # 各阶段进度：{阶段: {"done": n, "total": N}}
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.position = None
+        self._changed = asyncio.Event()
+        self._cancel_event = None
+        self._cancel_requested = False
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "position": self.position,
+            "cancelling": self._cancel_requested and not self.finished,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class JobContext:
+    """
+    任务进程内的上下文：
+    - workspace 为本任务独占的工作目录，临时文件都写在这里，互不覆盖
+    - report(阶段, 已完成数, 总数) 报告进度，任务被取消后抛出 JobCancelled
+    - limit(name) 占用一个跨进程的并发名额（例如同时编码的任务数），等待期间仍响应取消
+    - running 为本任务启动时正在运行的任务数（含本任务），可据此分配进程池大小
+    """
+
+    def __init__(self, job_id, workspace, conn, cancel_event, limits, running=1):
+        self.id = job_id
+        self.workspace = workspace
+        self.running = running
+        self._conn = conn
+        self._cancel_event = cancel_event
+        self._limits = limits
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, stage, done=None, total=None):
+        self.check_cancelled()
+        self._conn.send(("progress", (stage, done, total)))
+
+    @contextmanager
+    def limit(self, name, wait_stage=None):
+        semaphore = self._limits.get(name)
+        if semaphore is None:
+            yield
+            return
+        if not semaphore.acquire(block=False):
+            if wait_stage:
+                self.report(wait_stage)
+            while not semaphore.acquire(timeout=0.5):
+                self.check_cancelled()
+        # 通知主进程名额已占用：任务进程被强制结束时由主进程代为归还
+        self._conn.send(("acquired", name))
+        try:
+            yield
+        finally:
+            semaphore.release()
+            self._conn.send(("released", name))
+
+
+def _job_main(target, payload, conn, cancel_event, job_id, workspace, limits, running):
+    """任务进程入口：执行 target(payload, context)，进度和结果经管道发回主进程"""
+    logging.basicConfig(level=logging.INFO)
+    context = JobContext(job_id, workspace, conn, cancel_event, limits, running)
+    try:
+        conn.send(("result", target(payload, context)))
+    except JobCancelled:
+        conn.send(("cancelled", None))
+    except Exception as e:
+        logger.error(f"任务执行失败: {e}", exc_info=True)
+        conn.send(("error", getattr(e, "detail", None) or str(e) or type(e).__name__))
+    finally:
+        conn.close()
+
+
+def _receive(conn):
+    try:
+        return conn.recv()
+    except (EOFError, OSError):
+        return None
+
+
+class JobQueue:
+    """
+    有界的后台任务队列：
+    - submit() 立即返回 Job，队列已满时抛出 asyncio.QueueFull，由接口返回 429 实现背压
+    - 每个任务在独立的 spawn 子进程中运行，CPU 密集的绘制、编码不会阻塞 Web 服务的事件循环
+    - 同时运行的任务数由 workers（JOB_WORKERS，默认 CPU 核数）控制，等待中的任务数由 max_pending（JOB_QUEUE_SIZE）控制
+    - limits 为 {名称: 名额} 的跨进程并发限制，任务通过 context.limit(名称) 占用，超出时排队等待
+    - 每个任务有独立的工作目录 workspace_root/<进程号-随机串>/<job_id>，任务结束后无论结果如何都会删除
+    - 取消时先通知任务进程在下一次报告进度时自行退出（清理临时文件和进程池），超时未退出再强制结束
+    target 必须是模块级函数，签名为 target(payload, context)，context 为 JobContext；
+    on_finish(job) 在任务结束（含排队中被取消）时于主进程中调用
+    """
+
+    def __init__(self, target, max_pending=None, workers=None, limits=None, workspace_root=None, history=100,
+                 cancel_grace=10.0, on_finish=None):
+        self.target = target
+        self.on_finish = on_finish
+        self.max_pending = max_pending or int(os.getenv("JOB_QUEUE_SIZE", "8"))
+        self.workers = workers or int(os.getenv("JOB_WORKERS", "0")) or os.cpu_count() or 1
+        self.limits = dict(limits or {})
+        self.workspace_root = str(workspace_root or os.getenv("JOB_WORKSPACE_DIR", DEFAULT_WORKSPACE_ROOT))
+        self.workspace_dir = None
+        self.history = history
+        self.cancel_grace = cancel_grace
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._dispatchers = []
+        self._semaphores = {}
+        self._running = 0
+        # 每个运行中的任务占用一个线程等待管道消息，使用独立的线程池，不占用事件循环默认的线程池
+        self._receivers = None
+        self._context = multiprocessing.get_context("spawn")
+
+    def _start(self):
+        if self._queue is None:
+            # 只在主进程首次提交任务时创建本进程的工作目录，并清理已退出的服务进程遗留的目录
+            self._remove_stale_workspaces()
+            self.workspace_dir = os.path.join(self.workspace_root, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+            os.makedirs(self.workspace_dir, exist_ok=True)
+            atexit.register(shutil.rmtree, self.workspace_dir, True)
+            self._semaphores = {name: self._context.BoundedSemaphore(count) for name, count in self.limits.items()}
+            # 容量按仍在排队的任务计算（见 submit()），排队中被取消的任务虽留在队列里但不占名额
+            self._queue = asyncio.Queue()
+            self._receivers = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-receiver")
+            self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    def _remove_stale_workspaces(self):
+        """删除进程已不存在的 <进程号-随机串> 目录；其他目录（包括其他进程正在使用的）不受影响"""
+        try:
+            entries = list(os.scandir(self.workspace_root))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            pid, _, suffix = entry.name.partition("-")
+            if not entry.is_dir() or not pid.isdigit() or len(suffix) != 8:
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                logger.info(f"清理遗留的任务工作目录 {entry.path}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                # 进程存在但属于其他用户
+                pass
+
+    def submit(self, payload):
+        self._start()
+        if self._pending() >= self.max_pending:
+            raise asyncio.QueueFull()
+        job = Job(payload)
+        self._queue.put_nowait(job)
+        self._jobs[job.id] = job
+        self._update_positions()
+        self._trim_history()
+        logger.info(f"任务 {job.id[:8]} 已入队，排队中 {self._pending()} 个")
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _pending(self):
+        return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def cancel(self, job_id):
+        """取消任务，返回 Job（不存在时返回 None）；已结束的任务不受影响"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED)
+            self._update_positions()
+        elif not job._cancel_requested:
+            job._cancel_requested = True
+            job._cancel_event.set()
+            job._notify()
+            logger.info(f"任务 {job.id[:8]} 请求取消")
+        return job
+
+    async def watch(self, job):
+        """依次产出任务状态快照，任务结束后停止"""
+        while True:
+            changed = job._changed
+            yield job.snapshot()
+            if job.finished:
+                return
+            await changed.wait()
+
+    async def _dispatch(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status == QUEUED:
+                    await self._run(job)
+            except Exception as e:
+                logger.error(f"任务 {job.id[:8]} 调度失败: {e}", exc_info=True)
+                self._finish(job, FAILED, error=str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        receiver, sender = self._context.Pipe(duplex=False)
+        job._cancel_event = self._context.Event()
+        workspace = os.path.join(self.workspace_dir, job.id)
+        os.makedirs(workspace, exist_ok=True)
+        self._running += 1
+        process = self._context.Process(target=_job_main, name=f"job-{job.id[:8]}",
+                                        args=(self.target, job.payload, sender, job._cancel_event, job.id,
+                                              workspace, self._semaphores, self._running))
+        try:
+            process.start()
+        except BaseException:
+            self._running -= 1
+            raise
+        sender.close()
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._update_positions()
+        job._notify()
+
+        killer = loop.create_task(self._kill_after_grace(job, process))
+        held = {}
+        try:
+            while True:
+                message = await loop.run_in_executor(self._receivers, _receive, receiver)
+                if message is None:
+                    # 管道被关闭：进程崩溃或取消后被强制结束
+                    if job._cancel_requested:
+                        self._finish(job, CANCELLED)
+                    else:
+                        self._finish(job, FAILED, error=f"任务进程异常退出 (exitcode={process.exitcode})")
+                    break
+                kind, value = message
+                if kind == "progress":
+                    stage, done, total = value
+                    job.stage = stage
+                    job.progress[stage] = {"done": done, "total": total}
+                    job._notify()
+                elif kind == "acquired":
+                    held[value] = held.get(value, 0) + 1
+                elif kind == "released":
+                    held[value] -= 1
+                elif kind == "result":
+                    self._finish(job, SUCCEEDED, result=value)
+                    break
+                elif kind == "cancelled":
+                    self._finish(job, CANCELLED)
+                    break
+                elif kind == "error":
+                    self._finish(job, FAILED, error=value)
+                    break
+        finally:
+            self._running -= 1
+            killer.cancel()
+            receiver.close()
+            await loop.run_in_executor(None, process.join, self.cancel_grace)
+            if process.is_alive():
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+            for name, count in held.items():
+                for _ in range(count):
+                    try:
+                        self._semaphores[name].release()
+                    except ValueError:
+                        # 任务进程已归还但未来得及通知
+                        pass
+            await loop.run_in_executor(None, shutil.rmtree, workspace, True)
+
+    async def _kill_after_grace(self, job, process):
+        while not job._cancel_requested:
+            await job._changed.wait()
+        await asyncio.sleep(self.cancel_grace)
+        if process.is_alive():
+            logger.warning(f"任务 {job.id[:8]} 未在 {self.cancel_grace}s 内响应取消，强制结束")
+            process.terminate()
+
+    def _finish(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.position = None
+        job.finished_at = time.time()
+        logger.info(f"任务 {job.id[:8]} 结束: {status}" + (f" ({error})" if error else ""))
+        job._notify()
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                logger.error(f"任务 {job.id[:8]} 结束回调失败: {e}", exc_info=True)
+
+    def _update_positions(self):
+        position = 0
+        for job in self._jobs.values():
+            if job.status == QUEUED:
+                position += 1
+                if job.position != position:
+                    job.position = position
+                    job._notify()
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from video_encoder import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# 索引结构版本：表结构变化时递增，旧索引直接重建（索引可随时从磁盘文件恢复）
+LIBRARY_SCHEMA_VERSION = 1
+DEFAULT_LIBRARY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "library.db")
+# 海报缩略图宽度
+POSTER_WIDTH = 320
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    created_at REAL,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    poster TEXT,
+    source_config TEXT,
+    theme TEXT,
+    probed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS videos_created_at ON videos (created_at DESC);
+CREATE TABLE IF NOT EXISTS configs (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    updated_at REAL,
+    scenes INTEGER,
+    theme TEXT,
+    duration REAL
+);
+"""
+
+
+def probe_video(path, poster_path=None):
+    """读取视频的大小、时长、分辨率，并截取一帧作为海报；探测失败时只记录日志，返回已知的部分"""
+    stat = os.stat(path)
+    meta = {"name": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "created_at": stat.st_mtime, "duration": None, "width": None, "height": None, "poster": None}
+    try:
+        infos = ffmpeg_parse_infos(str(path))
+        meta["duration"] = infos.get("duration")
+        if infos.get("video_size"):
+            meta["width"], meta["height"] = infos["video_size"]
+    except Exception as e:
+        logger.warning(f"读取视频信息失败 {path}: {e}")
+    if poster_path is not None:
+        try:
+            # 取第 1 秒（不足时取中间）的画面，跳过可能是黑场的第一帧
+            at = min(1.0, (meta["duration"] or 0) / 2)
+            run_ffmpeg(["-ss", f"{at:.3f}", "-i", str(path), "-frames:v", "1",
+                        "-vf", f"scale={POSTER_WIDTH}:-2", "-q:v", "4", str(poster_path)])
+            meta["poster"] = os.path.basename(poster_path)
+        except Exception as e:
+            logger.warning(f"生成视频海报失败 {path}: {e}")
+    return meta
+
+
+def config_summary(data):
+    """配置的分镜数、主题和总时长"""
+    structure = data.get("分镜结构") if isinstance(data, dict) else None
+    if not isinstance(structure, dict):
+        return {"scenes": None, "theme": None, "duration": None}
+    scenes = structure.get("分镜列表") or []
+    cover = structure.get("封面提示词")
+    duration = 0.0
+    for scene in scenes:
+        try:
+            duration += float(scene.get("时长") or 0)
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return {"scenes": len(scenes), "theme": cover.get("主题") if isinstance(cover, dict) else None,
+            "duration": duration or None}
+
+
+class LibraryIndex:
+    """
+    生成视频和分镜配置的索引（SQLite），首页和列表接口直接分页查询，不再每次扫描目录：
+    - 视频：大小、时长、分辨率、生成时间、来源配置、主题和海报缩略图；渲染完成、删除时更新
+    - 配置：分镜数、主题、总时长；配置存储中的每次修改都会更新
+    - sync() 在服务启动时按修改时间与磁盘核对，只处理新增、变化和已删除的文件；
+      新视频先以基本信息入库，时长、分辨率和海报由 probe_pending() 在后台补齐
+    """
+
+    def __init__(self, db_path, video_dir, config_dir, poster_dir):
+        self.db_path = str(db_path)
+        self.video_dir = str(video_dir)
+        self.config_dir = str(config_dir)
+        self.poster_dir = str(poster_dir)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        os.makedirs(self.poster_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != LIBRARY_SCHEMA_VERSION:
+                self._db.executescript("DROP TABLE IF EXISTS videos; DROP TABLE IF EXISTS configs;")
+                self._db.execute(f"PRAGMA user_version = {LIBRARY_SCHEMA_VERSION}")
+            self._db.executescript(SCHEMA)
+
+    def poster_path(self, name):
+        return os.path.join(self.poster_dir, os.path.splitext(name)[0] + ".jpg")
+
+    def sync(self):
+        """按大小和修改时间与磁盘核对，返回 (新增或变化的视频数, 删除的视频数, 重新读取的配置数, 删除的配置数)"""
+        started = time.time()
+        videos = self._sync_videos()
+        configs = self._sync_configs()
+        logger.info(f"视频库索引已同步: 视频新增/变化 {videos[0]}、删除 {videos[1]}，"
+                    f"配置更新 {configs[0]}、删除 {configs[1]}，耗时 {time.time() - started:.2f}s")
+        return videos + configs
+
+    def _scan(self, directory, ext):
+        found = {}
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(ext) and not entry.name.startswith("."):
+                stat = entry.stat()
+                found[entry.name] = stat
+        return found
+
+    def _sync_videos(self):
+        found = self._scan(self.video_dir, ".mp4")
+        with self._lock:
+            indexed = {row["name"]: (row["size"], row["mtime_ns"])
+                       for row in self._db.execute("SELECT name, size, mtime_ns FROM videos")}
+        changed = [(name, stat) for name, stat in found.items()
+                   if indexed.get(name) != (stat.st_size, stat.st_mtime_ns)]
+        removed = [name for name in indexed if name not in found]
+        with self._lock, self._db:
+            # 新视频先以基本信息入库，来源配置等已有信息保留
+            self._db.executemany(
+                "INSERT INTO videos (name, size, mtime_ns, created_at, probed) VALUES (?, ?, ?, ?, 0) "
+                "ON CONFLICT(name) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, probed = 0",
+                [(name, stat.st_size, stat.st_mtime_ns, stat.st_mtime) for name, stat in changed])
+            self._db.executemany("DELETE FROM videos WHERE name = ?", [(name,) for name in removed])
+        for name in removed:
+            self._remove_poster(name)
+        return len(changed), len(removed)
+
+    def _sync_configs(self):
+        found = self._scan(self.config_dir, ".json")
+        with self._lock:
+            indexed = {row["name"]: row["mtime_ns"] for row in self._db.execute("SELECT name, mtime_ns FROM configs")}
+        changed = [(name, stat) for name, stat in found.items() if indexed.get(name) != stat.st_mtime_ns]
+        removed = [name for name in indexed if name not in found]
+        rows = []
+        for name, stat in changed:
+            try:
+                with open(os.path.join(self.config_dir, name), "r", encoding="utf-8") as f:
+                    summary = config_summary(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取配置失败 {name}: {e}")
+                summary = config_summary(None)
+            rows.append((name, stat.st_mtime_ns, stat.st_mtime, summary["scenes"], summary["theme"],
+                         summary["duration"]))
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO configs VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.executemany("DELETE FROM configs WHERE name = ?", [(name,) for name in removed])
+        return len(changed), len(removed)
+
+    def probe_pending(self):
+        """补齐尚未读取时长、分辨率和海报的视频（启动同步后在后台线程中调用）"""
+        with self._lock:
+            names = [row["name"] for row in self._db.execute("SELECT name FROM videos WHERE probed = 0")]
+        for name in names:
+            try:
+                meta = probe_video(os.path.join(self.video_dir, name), self.poster_path(name))
+            except OSError:
+                # 同步之后文件又被删除
+                self.remove_video(name)
+                continue
+            self.put_video(meta)
+
+    def put_video(self, meta, source_config=None, theme=None):
+        """写入 probe_video() 的结果；source_config、theme 为空时保留已有的值"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO videos (name, size, mtime_ns, created_at, duration, width, height, poster, "
+                "source_config, theme, probed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                "duration = excluded.duration, width = excluded.width, height = excluded.height, "
+                "poster = excluded.poster, probed = 1, "
+                "source_config = COALESCE(excluded.source_config, source_config), "
+                "theme = COALESCE(excluded.theme, theme)",
+                (meta["name"], meta["size"], meta["mtime_ns"], meta["created_at"], meta["duration"],
+                 meta["width"], meta["height"], meta["poster"], source_config, theme))
+
+    def remove_video(self, name):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM videos WHERE name = ?", (name,))
+        self._remove_poster(name)
+
+    def _remove_poster(self, name):
+        try:
+            os.remove(self.poster_path(name))
+        except FileNotFoundError:
+            pass
+
+    def update_config(self, name, data):
+        """配置被创建、修改（data 为新内容）或删除（data 为 None）时调用"""
+        with self._lock, self._db:
+            if data is None:
+                self._db.execute("DELETE FROM configs WHERE name = ?", (name,))
+                return
+            summary = config_summary(data)
+            # 修改时间留空：写盘是延迟进行的，下次启动同步时会按磁盘文件重新核对
+            self._db.execute("INSERT OR REPLACE INTO configs VALUES (?, NULL, ?, ?, ?, ?)",
+                             (name, time.time(), summary["scenes"], summary["theme"], summary["duration"]))
+
+    def _page(self, table, order, offset, limit):
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            rows = self._db.execute(f"SELECT * FROM {table} ORDER BY {order} LIMIT ? OFFSET ?",
+                                    (limit, offset)).fetchall()
+        return [dict(row) for row in rows], total
+
+    def videos(self, offset=0, limit=50):
+        """按生成时间从新到旧分页，返回 (视频列表, 总数)"""
+        return self._page("videos", "created_at DESC, name", offset, limit)
+
+    def configs(self, offset=0, limit=50):
+        """按名称分页，返回 (配置列表, 总数)"""
+        return self._page("configs", "name", offset, limit)
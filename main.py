@@ -1,15 +1,18 @@
-from PIL import Image, ImageDraw, ImageFont
-import edge_tts
-from moviepy.editor import *
 import asyncio
-from moviepy.editor import AudioFileClip
 from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
 from langchain_deepseek import ChatDeepSeek
 import os
 from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-from txt2img import TextToImg
+from txt2img import AsyncTextToImg, ComfyPool
+from image_cache import ImageCache
+from tts_audio import synthesize_speech
+from frame_template import FrameTemplate, FrameRenderer, SAVE_FRAMES
+from video_encoder import StillVideoEncoder
 from langchain_core.output_parsers import StrOutputParser
+from PIL import Image
+import io
 import json
+import random
 import re
 from dotenv import load_dotenv
 
@@ -17,6 +20,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def save_candidate(image, path):
+    """把内存中的候选图（BytesIO 或 PIL.Image）写到 path，已是本地路径时直接返回"""
+    if isinstance(image, str):
+        return image
+    if isinstance(image, Image.Image):
+        image.save(path)
+    elif isinstance(image, io.BytesIO):
+        with open(path, "wb") as f:
+            f.write(image.getvalue())
+    else:
+        return None
+    return path
+
+
 def main(topic:str="爱情三脚猫",keyframes:int=8):
     llm = ChatDeepSeek(model=os.getenv('MODEL_NAME'))
     file_prompt1 =  open(file="prompt/心理短视频/Generate_article.txt", mode="r", encoding="utf-8").read()
@@ -226,108 +243,136 @@ def main(topic:str="爱情三脚猫",keyframes:int=8):
     print(result)
     print("-"*30)
 
-    def text_to_image(prompt_text):
+    # 1. 生成插画（封面 + 全部分镜一次性入队），同时合成音频
+    async def synthesize(text, out_path, semaphore, retries):
         """
-        调用ComfyUI工作流生成图片，返回新图片的路径
+        合成单条语音（命中语音缓存时直接复制），返回带 PCM 的 SpeechAudio，受并发信号量限制，失败时指数退避重试
+        后端由 TTS_BACKEND 或 VOICE_MODEL 的前缀（如 local:）决定
         """
-        URL = os.getenv("WORK_URL")
-        OUTPUT_DIR = os.getenv("OUTPUT_DIR")
-        result_path = TextToImg(URL, OUTPUT_DIR).generate_image(prompt_text,work_path=os.getenv("WORK_PATH"))
-        return result_path
-
-
-
-    # 1. 生成插画
-    # 生成封面插画
-    cover_img_path = text_to_image(', '.join(封面))
-    print('封面插画路径:', cover_img_path)
-
-    # 合成封面音频
-    async def synthesize(text, out_path):
-        communicate = edge_tts.Communicate(text, os.getenv("VOICE_MODEL"))
-        await communicate.save(out_path)
+        async with semaphore:
+            for attempt in range(retries):
+                try:
+                    return await synthesize_speech(text, os.getenv("VOICE_MODEL"), output_path=out_path)
+                except Exception as e:
+                    if attempt == retries - 1:
+                        raise
+                    delay = 0.5 * 2 ** attempt + random.uniform(0, 0.5)
+                    print(f"语音合成失败（{out_path}），{delay:.1f}s 后重试: {e}")
+                    await asyncio.sleep(delay)
+
+    async def synthesize_all(items):
+        """在同一个事件循环中并发合成封面和全部分镜的语音，并发数由 TTS_CONCURRENCY 控制"""
+        semaphore = asyncio.Semaphore(int(os.getenv("TTS_CONCURRENCY", "4")))
+        retries = int(os.getenv("TTS_RETRIES", "3"))
+        return await asyncio.gather(*(synthesize(text, out_path, semaphore, retries) for text, out_path in items))
+
+    async def generate_images(prompt_texts, negative_texts):
+        """
+        调用ComfyUI工作流批量生成图片，按提交顺序返回图片
+        配置了 OUTPUT_DIR 时返回本地路径，否则通过 /view 接口直接读入内存
+        配置了 WORK_URLS（逗号分隔的多个 ComfyUI 地址）时按队列长度分发到多个后端
+        相同提示词的插画从 IMAGE_CACHE_DIR 缓存中复用，REUSE_CACHED_IMAGES=false 时强制换种子重新生成
+        IMAGE_CANDIDATES > 1 时每个分镜一次采样生成多张候选图，自动选择得分最高的一张
+        返回 (图片列表, 候选列表)，未开启多候选时候选列表中为 None
+        """
+        output_dir = os.getenv("OUTPUT_DIR")
+        work_urls = [url.strip() for url in os.getenv("WORK_URLS", "").split(",") if url.strip()]
+        cache = ImageCache(os.getenv("IMAGE_CACHE_DIR", "cache/images"),
+                           max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+        reuse_cached = os.getenv("REUSE_CACHED_IMAGES", "true").lower() != "false"
+        if work_urls:
+            fetch = "bytes"
+            client = ComfyPool(work_urls, fetch=fetch, cache=cache, reuse_cached=reuse_cached)
+        else:
+            fetch = "path" if output_dir else "bytes"
+            client = AsyncTextToImg(os.getenv("WORK_URL"), output_dir, fetch=fetch,
+                                    cache=cache, reuse_cached=reuse_cached)
+        candidate_count = int(os.getenv("IMAGE_CANDIDATES", "1"))
+        img_paths = [None] * len(prompt_texts)
+        img_candidates = [None] * len(prompt_texts)
+        async with client:
+            if candidate_count > 1:
+                async for index, candidates in client.generate_candidates(
+                        prompt_texts, work_path=os.getenv("WORK_PATH"), negative_texts=negative_texts,
+                        count=candidate_count):
+                    print(f"插画 {index} 生成完成，候选得分: {[candidate['score'] for candidate in candidates]}")
+                    img_paths[index] = candidates[0]['image']
+                    img_candidates[index] = candidates
+            else:
+                async for index, img_path in client.generate_many(prompt_texts, work_path=os.getenv("WORK_PATH"),
+                                                                  negative_texts=negative_texts):
+                    print(f"插画 {index} 生成完成: {img_path if fetch == 'path' else '(内存)'}")
+                    img_paths[index] = img_path
+            if work_urls:
+                for backend_stats in client.stats():
+                    print(f"ComfyUI 后端统计: {backend_stats}")
+        print(f"插画缓存统计: {cache.stats()}")
+        return img_paths, img_candidates
 
     cover_audio_path = "output/cover.mp3"
     cover_text = f"本期要讲的主题是{topic}"
-    asyncio.run(synthesize(cover_text, cover_audio_path))
-
-    # 生成封面帧
-    bg = Image.new("RGBA", (1080, 1920), (255, 255, 255, 255))
-    fg = Image.open(cover_img_path).convert('RGBA').resize((800, 800))
-    bg.paste(fg, (140, 960), fg)  # 下半部分
-    draw = ImageDraw.Draw(bg)
-    # 左上角显示主题
-    theme_font = ImageFont.truetype("msyh.ttc", 40)
-    draw.text((50, 50), f"本期主题：{topic}", fill=(0, 0, 0), font=theme_font)
-    cover_frame_path = "output/cover_frame.png"
-    bg.save(cover_frame_path)
-    # 合成封面clip
-    cover_audio_clip = AudioFileClip(cover_audio_path)
-    cover_duration = cover_audio_clip.duration
-    cover_clip = ImageClip(cover_frame_path).set_duration(cover_duration)
-    cover_clip = cover_clip.set_audio(cover_audio_clip)
-
-    # 1.5 生成分镜插画
-    for scene in result:
-        prompt = ','.join(scene['正向提示词'])
-        img_path = text_to_image(prompt)
-        print(img_path)
-        scene['img'] = img_path
 
-    # 3. 合成音频
-    for scene in result:
-        zh_text = scene['字幕']['中文']
-        audio_path = f"output/scene_{scene['分镜编号']}.mp3"
-        asyncio.run(synthesize(zh_text, audio_path))
-        scene['audio'] = audio_path
-
-    # 4. 合成视频
-    clips = [cover_clip]  # 先加封面clip
-    for scene in result:
-        # 创建白色背景
-        bg = Image.new("RGBA", (1080, 1920), (255, 255, 255, 255))
-        # 加载插画并缩放
-        fg = Image.open(scene['img']).convert('RGBA').resize((800, 800))
-        bg.paste(fg, (140, 500), fg)
-        # 画黑线
-        draw = ImageDraw.Draw(bg)
-        draw.line([(0, 1300), (1080, 1300)], fill=(0, 0, 0), width=5)
-        # 左上角显示主题
-        theme_font = ImageFont.truetype("msyh.ttc", 36)
-        draw.text((50, 30), f"本期主题：{topic}", fill=(0, 0, 0), font=theme_font)
-        # 分镜标题（大号，居中）
-        title_font = ImageFont.truetype("msyh.ttc", 52)
-        title_text = scene['标题']
-        title_bbox = title_font.getbbox(title_text)
-        title_w = title_bbox[2] - title_bbox[0]
-        title_x = (1080 - title_w) // 2
-        draw.text((title_x, 90), title_text, fill=(0, 0, 0), font=title_font)
-        # 字幕
-        zh_text = scene['字幕']['中文']
-        en_text = scene['字幕']['英文']
-        zh_font = ImageFont.truetype("msyh.ttc", 40)
-        en_font = ImageFont.truetype("msyh.ttc", 26)
-        zh_bbox = zh_font.getbbox(zh_text)
-        en_bbox = en_font.getbbox(en_text)
-        zh_w, zh_h = zh_bbox[2] - zh_bbox[0], zh_bbox[3] - zh_bbox[1]
-        en_w, en_h = en_bbox[2] - en_bbox[0], en_bbox[3] - en_bbox[1]
-        zh_x = (1080 - zh_w) // 2
-        en_x = (1080 - en_w) // 2
-        draw.text((zh_x, 1400), zh_text, fill=(0, 0, 0), font=zh_font)
-        draw.text((en_x, 1480), en_text, fill=(0, 0, 0), font=en_font)
-        # 保存帧
-        frame_path = f"output/frame_{scene['分镜编号']}.png"
-        bg.save(frame_path)
-        # 合成clip
-        audio_clip = AudioFileClip(scene['audio'])
-        duration = audio_clip.duration
-        img_clip = ImageClip(frame_path).set_duration(duration)
-        img_clip = img_clip.set_audio(audio_clip)
-        clips.append(img_clip)
-
-    final_clip = concatenate_videoclips(clips, method="compose")
-    final_clip.write_videofile(f"output/{topic}_{keyframes}.mp4", fps=24)
+    async def produce_media():
+        prompt_texts = [', '.join(封面.get('正向提示词', []))] + [','.join(scene['正向提示词']) for scene in result]
+        negative_texts = [', '.join(封面.get('负向提示词', []))] + [','.join(scene.get('负向提示词', [])) for scene in result]
+        image_task = asyncio.create_task(generate_images(prompt_texts, negative_texts))
+
+        # 合成封面和分镜音频，与插画生成同时进行
+        for scene in result:
+            scene['audio'] = f"output/scene_{scene['分镜编号']}.mp3"
+        tts_items = [(cover_text, cover_audio_path)] + [(scene['字幕']['中文'], scene['audio']) for scene in result]
+        image_result, audios = await asyncio.gather(image_task, synthesize_all(tts_items))
+        return image_result, audios
+
+    (img_paths, img_candidates), audios = asyncio.run(produce_media())
+    cover_img_path = img_paths[0]
+    print('封面插画:', cover_img_path)
+    for scene, img_path in zip(result, img_paths[1:]):
+        scene['img'] = img_path
 
+    # 保存所有候选图及得分，便于在网页端查看或手动替换；
+    # 通过 /view 读入内存的候选图（fetch 为 bytes / image）写到 output/<主题>_candidates/ 下
+    if any(img_candidates):
+        candidate_dir = f"output/{topic}_candidates"
+        os.makedirs(candidate_dir, exist_ok=True)
+        manifest = []
+        for index, candidates in enumerate(img_candidates):
+            if not candidates:
+                continue
+            scene_id = "封面" if index == 0 else result[index - 1]['分镜编号']
+            entries = []
+            for rank, candidate in enumerate(candidates):
+                ext = os.path.splitext(candidate.get('filename') or "")[1] or ".png"
+                if isinstance(candidate['image'], Image.Image):
+                    ext = ".png"
+                path = save_candidate(candidate['image'], os.path.join(candidate_dir, f"{scene_id}_{rank}{ext}"))
+                entries.append({**{key: value for key, value in candidate.items() if key != 'image'}, "path": path})
+            manifest.append({"分镜编号": scene_id, "候选": entries})
+        with open(f"output/{topic}_candidates.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 生成封面帧和分镜帧：字体和每帧相同的背景、主题、分隔线只加载/绘制一次，
+    # 所有帧在进程池中并行渲染（进程数由 FRAME_WORKERS 配置），按分镜顺序以 RGB 数组返回，
+    # SAVE_FRAMES=true 时才额外保存 PNG
+    template = FrameTemplate(topic, divider_y=1300)
+    frame_jobs = [("cover", cover_img_path, "output/cover_frame.png" if SAVE_FRAMES else None, {})] + [
+        ("scene", scene['img'], f"output/frame_{scene['分镜编号']}.png" if SAVE_FRAMES else None,
+         {"title": scene['标题'], "zh_text": scene['字幕']['中文'], "en_text": scene['字幕']['英文'], "en_min_y": 1480})
+        for scene in result
+    ]
+    renderer = FrameRenderer()
+    try:
+        frames = renderer.render(template, frame_jobs)
+    finally:
+        renderer.close()
+
+    # 4. 合成视频：每个分镜的静止画面只编码一次，拼接后一次性混入旁白
+    # （音频编码与原 write_videofile 对 mp4 的默认值 libmp3lame 保持一致）
+    encoder = StillVideoEncoder(threads=None, audio_codec="libmp3lame")
+    try:
+        encoder.render(frames, [audio.pcm for audio in audios], f"output/{topic}_{keyframes}.mp4", audios[0].sample_rate)
+    finally:
+        frames.close()
 
 if __name__ == '__main__':
     main("如何判断对人的滤镜",keyframes=8)
\ No newline at end of file
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+
+from disk_cache import DiskCache, image_digest
+
+# 片段格式版本：编码方式变化时递增，旧片段不再命中
+SEGMENT_FORMAT_VERSION = 1
+DEFAULT_SEGMENT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "segments")
+
+_default_cache = None
+
+
+class SegmentCache(DiskCache):
+    """
+    分镜视频片段缓存：key 为 (插画内容, 字幕与标题, 帧模板, 语音设置, 编码参数) 的哈希，
+    片段存为 root/ab/<key>.mp4（只有视频流），帧数等信息存为同名 .json，按总字节数 LRU 淘汰；
+    复用前调用方应核对帧数与本次旁白时长是否一致
+    """
+
+    label = "分镜片段缓存"
+    probe_exts = (".mp4",)
+
+    def __init__(self, root=DEFAULT_SEGMENT_CACHE_DIR, max_bytes=2 * 1024 ** 3):
+        super().__init__(root, max_bytes=max_bytes, sidecar_ext=".json")
+
+    @staticmethod
+    def make_key(image, kind, options, template_spec, voice, profile):
+        """
+        image 为插画路径，kind / options 与帧渲染参数相同，template_spec 为 FrameTemplate.spec()，
+        voice 为 (旁白文本, 音色, 音调, 合成后端版本)（音量只影响音频，不参与 key），profile 为 StillVideoEncoder.profile()
+        """
+        data = json.dumps({
+            "image": image_digest(image), "kind": kind, "options": options, "template": template_spec,
+            "voice": list(voice), "profile": profile, "format": SEGMENT_FORMAT_VERSION,
+        }, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    # 命中时返回 (片段路径, 元数据)，否则返回 None
+    def lookup(self, key):
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(self.sidecar_path(path), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return path, meta
+
+    def save(self, key, segment_path, meta):
+        sidecar = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        return self.put_file(key, segment_path, sidecar=sidecar)
+
+
+def get_segment_cache():
+    """进程内共用的片段缓存，目录和容量可由 SEGMENT_CACHE_DIR / SEGMENT_CACHE_MAX_MB 配置"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SegmentCache(os.getenv("SEGMENT_CACHE_DIR", DEFAULT_SEGMENT_CACHE_DIR),
+                                      max_bytes=int(os.getenv("SEGMENT_CACHE_MAX_MB", "2048")) * 1024 ** 2)
+    return _default_cache
@@ -0,0 +1,19 @@
+from text_layout import NO_LINE_START, layout_lines
+
+
+class FixedFont:
+    """每个字符宽 20 的假字体，不依赖字体文件"""
+
+    def getlength(self, text):
+        return 20.0 * len(text)
+
+
+def test_consecutive_no_line_start_punctuation():
+    lines = [line for line, _ in layout_lines("你好！！？", FixedFont(), 80)]
+    assert "".join(lines) == "你好！！？"
+    assert all(line[0] not in NO_LINE_START for line in lines)
+
+
+def test_single_no_line_start_punctuation():
+    lines = [line for line, _ in layout_lines("你好你好。", FixedFont(), 80)]
+    assert lines == ["你好你", "好。"]
@@ -0,0 +1,122 @@
+import unicodedata
+
+# 不能出现在行首的标点（避头）：遇到时把上一行最后一个字一起挤到下一行
+NO_LINE_START = set("，。！？、；：…,.!?;:)]}）】》」』”’%")
+# 不能出现在行尾的标点（避尾）
+NO_LINE_END = set("([{（【《「『“‘")
+
+# 字形宽度缓存：(字体文件, 字号) -> {字符: 步进宽度}
+_GLYPH_WIDTHS = {}
+
+
+def _font_key(font):
+    path = getattr(font, "path", None)
+    if path is None:
+        return id(font)
+    return path, getattr(font, "size", None), getattr(font, "index", 0)
+
+
+def glyph_widths(font):
+    """取字体的字形宽度表，同一 (字体文件, 字号) 在进程内只测量一次每个字符"""
+    key = _font_key(font)
+    widths = _GLYPH_WIDTHS.get(key)
+    if widths is None:
+        widths = _GLYPH_WIDTHS[key] = {}
+    return widths
+
+
+def _is_wide(char):
+    return unicodedata.east_asian_width(char) in ("W", "F")
+
+
+def _tokens(text):
+    """切分为可断行的最小单元：CJK 单字、连续的西文单词、空白"""
+    tokens = []
+    word = ""
+    for char in text:
+        if char.isspace() or _is_wide(char) or char in NO_LINE_START or char in NO_LINE_END:
+            if word:
+                tokens.append(word)
+                word = ""
+            tokens.append(" " if char.isspace() else char)
+        else:
+            word += char
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+def layout_lines(text, font, max_width):
+    """
+    贪心断行，返回 [(行文本, 行宽)]：
+    - 每个字符的宽度查表累加，整体为线性复杂度
+    - 中英文混排时 CJK 字可在任意位置断开，西文按单词断开，超长单词按字符断开
+    - 行首不出现 NO_LINE_START 中的标点，行尾不出现 NO_LINE_END 中的标点
+    """
+    widths = glyph_widths(font)
+
+    def width_of(token):
+        total = 0.0
+        for char in token:
+            w = widths.get(char)
+            if w is None:
+                w = widths[char] = font.getlength(char)
+            total += w
+        return total
+
+    lines = []
+    line = []  # [(单元, 宽度)]
+    line_width = 0.0
+
+    def flush():
+        nonlocal line, line_width
+        while line and line[-1][0] == " ":
+            line_width -= line.pop()[1]
+        if line:
+            lines.append(("".join(token for token, _ in line), line_width))
+        line, line_width = [], 0.0
+
+    for token in _tokens(text):
+        if token == " " and not line:
+            continue
+        w = width_of(token)
+        # 单个西文单词比整行还宽时按字符拆开
+        if w > max_width and len(token) > 1:
+            for char in token:
+                cw = width_of(char)
+                if line and line_width + cw > max_width:
+                    flush()
+                line.append((char, cw))
+                line_width += cw
+            continue
+        if not line or line_width + w <= max_width:
+            line.append((token, w))
+            line_width += w
+            continue
+
+        carry = []
+        if token in NO_LINE_START:
+            # 连续的避头标点（如“！！？”）一起挤到下一行，并带上它们前面的一个字，下一行不会以标点开头
+            while len(line) > 1 and line[-1][0] in NO_LINE_START:
+                carry.insert(0, line.pop())
+                line_width -= carry[0][1]
+            if len(line) > 1:
+                carry.insert(0, line.pop())
+                line_width -= carry[0][1]
+        while len(line) > 1 and line[-1][0] in NO_LINE_END:
+            carry.insert(0, line.pop())
+            line_width -= carry[0][1]
+        flush()
+        for item in carry:
+            line.append(item)
+            line_width += item[1]
+        if token != " ":
+            line.append((token, w))
+            line_width += w
+    flush()
+    return lines
+
+
+def wrap_text(text, font, max_width):
+    """将文本换行以适应最大宽度，返回各行文本"""
+    return [line for line, _ in layout_lines(text, font, max_width)]
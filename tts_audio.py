@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+
+import numpy as np
+from moviepy.config import get_setting
+
+from tts_backends import resolve_voice
+from tts_cache import get_tts_cache, build_meta
+
+logger = logging.getLogger(__name__)
+
+# 各后端统一输出 24kHz 单声道 MP3
+SAMPLE_RATE = 24000
+MP3_BITRATE = "48k"
+# 调整音量后峰值不超过 -1 dBFS，避免放大时削波失真
+PEAK_LIMIT = 10 ** (-1 / 20)
+
+
+class SpeechAudio:
+    """一条合成好的语音：PCM 缓冲区（float32，形状 (采样数, 1)，取值 -1~1）及其元数据"""
+
+    def __init__(self, pcm, sample_rate, meta, path=None):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.meta = meta
+        self.path = path
+
+    @property
+    def duration(self):
+        if self.pcm is None:
+            return self.meta.get("duration")
+        return len(self.pcm) / self.sample_rate
+
+
+def _ffmpeg(args, data):
+    result = subprocess.run([get_setting("FFMPEG_BINARY"), "-v", "error", *args],
+                            input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 执行失败: {result.stderr.decode('utf-8', 'ignore').strip()}")
+    return result.stdout
+
+
+def decode_mp3(data, sample_rate=SAMPLE_RATE):
+    """MP3 字节直接通过管道解码为 PCM，不落盘"""
+    raw = _ffmpeg(["-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"], data)
+    return (np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0).reshape(-1, 1)
+
+
+def encode_mp3(pcm, sample_rate=SAMPLE_RATE):
+    """PCM 一次性编码为 MP3 字节"""
+    samples = (np.clip(pcm, -1.0, 32767 / 32768) * 32768).astype(np.int16)
+    return _ffmpeg(["-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+                    "-c:a", "libmp3lame", "-b:a", MP3_BITRATE, "-f", "mp3", "pipe:1"], samples.tobytes())
+
+
+def apply_volume(pcm, volume):
+    """整体缩放音量；放大后峰值超过 PEAK_LIMIT 时降低增益，保留余量而不是削波"""
+    if volume == 1.0 or not len(pcm):
+        return pcm
+    gain = float(volume)
+    peak = float(np.abs(pcm).max())
+    if peak * gain > PEAK_LIMIT:
+        gain = PEAK_LIMIT / peak
+        logger.info(f"音量 {volume} 会导致削波，增益限制为 {gain:.2f}")
+    return pcm * np.float32(gain)
+
+
+async def synthesize_speech(text, voice, pitch=0, volume=1.0, output_path=None, cache=None, backend=None,
+                            decode=True):
+    """
+    合成语音并返回 SpeechAudio：
+    - voice 可带后端前缀（如 local:xxx），否则使用 backend 参数或 TTS_BACKEND 指定的后端
+    - 后端产出的音频块在内存中拼接，只解码一次得到 PCM
+    - 音量为 1 时原样保存 MP3，否则在 PCM 上缩放后一次编码写出
+    - 结果写入语音缓存，命中时跳过合成；decode=False 且无需调整音量时不解码 PCM（pcm 为 None）
+    """
+    tts, voice = resolve_voice(voice, backend)
+    cache = cache or get_tts_cache()
+    loop = asyncio.get_running_loop()
+
+    cached = cache.lookup(text, voice, pitch, volume, tts.version)
+    if cached:
+        path, meta = cached
+        pcm = None
+        if decode:
+            with open(path, "rb") as f:
+                pcm = await loop.run_in_executor(None, decode_mp3, f.read())
+        if output_path:
+            shutil.copyfile(path, output_path)
+        return SpeechAudio(pcm, SAMPLE_RATE, meta, output_path or path)
+
+    # 其他音量（例如试听时）合成过的原始音频可以直接复用，只需重新缩放
+    raw = cache.lookup(text, voice, pitch, 1.0, tts.version) if volume != 1.0 else None
+    if raw:
+        with open(raw[0], "rb") as f:
+            audio = f.read()
+        boundaries = raw[1].get("boundaries", [])
+    else:
+        audio, boundaries = await tts.synthesize(text, voice, pitch)
+
+    meta = build_meta(text, voice, pitch, volume, len(audio), boundaries, tts.version)
+    pcm = None
+    if decode or volume != 1.0:
+        pcm = await loop.run_in_executor(None, decode_mp3, audio)
+        pcm = apply_volume(pcm, volume)
+        meta["duration"] = round(len(pcm) / SAMPLE_RATE, 3)
+    if volume != 1.0:
+        audio = await loop.run_in_executor(None, encode_mp3, pcm)
+    path = cache.save_bytes(text, voice, pitch, volume, tts.version, audio, meta)
+    if output_path:
+        with open(output_path, "wb") as f:
+            f.write(audio)
+    return SpeechAudio(pcm, SAMPLE_RATE, meta, output_path or path)
+
+
+async def stream_speech(text, voice, pitch=0, cache=None, backend=None, chunk_size=16 * 1024):
+    """
+    边合成边产出原始 MP3 数据块（音量为 1），用于低延迟试听：
+    缓存命中时直接读文件；否则一边转发后端的数据块一边写入缓存目录下的临时文件，
+    完整结束后移入缓存，之后相同文本、音色、音调的合成（任意音量）都会复用这份音频
+    """
+    tts, voice = resolve_voice(voice, backend)
+    cache = cache or get_tts_cache()
+    cached = cache.lookup(text, voice, pitch, 1.0, tts.version)
+    if cached:
+        with open(cached[0], "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield data
+        return
+
+    part_path = os.path.join(cache.root, f".stream-{uuid.uuid4().hex}.mp3")
+    boundaries = []
+    size = 0
+    try:
+        with open(part_path, "wb") as f:
+            async for data in tts.stream(text, voice, pitch, boundaries):
+                f.write(data)
+                size += len(data)
+                yield data
+        if size:
+            cache.save(text, voice, pitch, 1.0, tts.version, part_path,
+                       build_meta(text, voice, pitch, 1.0, size, boundaries, tts.version), move=True)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
@@ -0,0 +1,157 @@
+import abc
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import edge_tts
+import numpy as np
+
+# edge-tts 边界事件的时间单位（100ns）
+TICKS_PER_SECOND = 10 ** 7
+# 本地引擎输出的采样率与 edge-tts 一致
+LOCAL_SAMPLE_RATE = 24000
+# 本地引擎每个字的时长、停顿符号的时长（秒）
+LOCAL_CHAR_SECONDS = 0.18
+LOCAL_PAUSE_SECONDS = 0.3
+LOCAL_PAUSE_CHARS = set("，。！？、；：…,.!?;: \n")
+# 未指定前缀的音色使用的后端，可由 TTS_BACKEND 配置
+DEFAULT_BACKEND = "edge"
+
+
+def pitch_to_str(pitch):
+    return f"+{pitch}Hz" if pitch >= 0 else f"{pitch}Hz"
+
+
+class TTSBackend(abc.ABC):
+    """
+    语音合成后端：stream() 边合成边产出 MP3 数据块，传入 boundaries 列表时顺便收集逐词时间戳（秒）
+    version 参与语音缓存的 key，切换或升级后端不会复用旧音频
+    """
+
+    name = ""
+    version = ""
+
+    @abc.abstractmethod
+    def stream(self, text, voice, pitch=0, boundaries=None):
+        """异步生成器：依次产出 MP3 数据块"""
+
+    async def synthesize(self, text, voice, pitch=0):
+        """返回 (MP3 字节, 逐词时间戳列表)"""
+        audio = bytearray()
+        boundaries = []
+        async for data in self.stream(text, voice, pitch, boundaries):
+            audio.extend(data)
+        return bytes(audio), boundaries
+
+
+class EdgeTTSBackend(TTSBackend):
+    """微软 edge-tts 在线合成"""
+
+    name = "edge"
+    version = f"edge-tts-{getattr(edge_tts, '__version__', 'unknown')}"
+
+    async def stream(self, text, voice, pitch=0, boundaries=None):
+        communicate = edge_tts.Communicate(text, voice, pitch=pitch_to_str(pitch), boundary="WordBoundary")
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+            elif boundaries is not None and chunk["type"] in ("WordBoundary", "SentenceBoundary"):
+                boundaries.append({
+                    "text": chunk["text"],
+                    "offset": chunk["offset"] / TICKS_PER_SECOND,
+                    "duration": chunk["duration"] / TICKS_PER_SECOND,
+                })
+
+
+def render_local_speech(text, voice, pitch=0):
+    """
+    本地确定性合成（在进程池中运行）：每个字生成一段由 (音色, 字) 决定音高的短音，标点处停顿
+    相同输入总是得到相同音频，用于离线测试和不依赖外部服务的批量生成
+    """
+    from tts_audio import encode_mp3
+
+    t = np.arange(int(LOCAL_SAMPLE_RATE * LOCAL_CHAR_SECONDS)) / LOCAL_SAMPLE_RATE
+    envelope = np.sin(np.pi * t / LOCAL_CHAR_SECONDS)
+    pause = np.zeros(int(LOCAL_SAMPLE_RATE * LOCAL_PAUSE_SECONDS))
+
+    segments = []
+    boundaries = []
+    offset = 0.0
+    for char in text:
+        if char in LOCAL_PAUSE_CHARS:
+            segments.append(pause)
+            offset += LOCAL_PAUSE_SECONDS
+            continue
+        seed = int.from_bytes(hashlib.md5(f"{voice}|{char}".encode("utf-8")).digest()[:4], "little")
+        freq = 160 + seed % 160 + pitch * 4
+        segments.append(envelope * (0.3 * np.sin(2 * np.pi * freq * t) + 0.1 * np.sin(4 * np.pi * freq * t)))
+        boundaries.append({"text": char, "offset": round(offset, 3), "duration": LOCAL_CHAR_SECONDS})
+        offset += LOCAL_CHAR_SECONDS
+
+    pcm = np.concatenate(segments or [pause]).astype(np.float32).reshape(-1, 1)
+    return encode_mp3(pcm, LOCAL_SAMPLE_RATE), boundaries
+
+
+class LocalTTSBackend(TTSBackend):
+    """本地 CPU 合成，在进程池中运行，并发度由 LOCAL_TTS_WORKERS 控制（默认 CPU 核数）"""
+
+    name = "local"
+    version = "local-1"
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or int(os.getenv("LOCAL_TTS_WORKERS", "0")) or os.cpu_count()
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    async def stream(self, text, voice, pitch=0, boundaries=None, chunk_size=16 * 1024):
+        loop = asyncio.get_running_loop()
+        audio, local_boundaries = await loop.run_in_executor(self.pool, render_local_speech, text, voice, pitch)
+        if boundaries is not None:
+            boundaries.extend(local_boundaries)
+        for i in range(0, len(audio), chunk_size):
+            yield audio[i:i + chunk_size]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+BACKENDS = {"edge": EdgeTTSBackend, "local": LocalTTSBackend}
+_instances = {}
+
+
+def get_backend(name=None):
+    """按名称取后端实例（进程内单例），未指定时使用 TTS_BACKEND 环境变量"""
+    name = name or os.getenv("TTS_BACKEND", DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError(f"未知的语音合成后端: {name}")
+    if name not in _instances:
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
+
+
+def resolve_voice(voice, backend=None):
+    """
+    解析音色：带前缀的音色（如 local:zh-CN-YunxiNeural）使用前缀指定的后端，
+    否则使用 backend 参数或默认后端；返回 (后端实例, 去掉前缀的音色名)
+    """
+    prefix, sep, name = voice.partition(":")
+    if sep and prefix in BACKENDS:
+        return get_backend(prefix), name
+    return get_backend(backend), voice
+
+
+def close_backends():
+    """关闭各后端占用的进程池；在子进程中运行时须在退出前调用，否则进程会等待池中的 worker 而无法退出"""
+    for backend in _instances.values():
+        close = getattr(backend, "close", None)
+        if close is not None:
+            close()
+    _instances.clear()
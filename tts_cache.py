@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+
+from disk_cache import DiskCache
+
+# 缓存的 MP3 为 24kHz / 48kbps 单声道，时长可由字节数直接算出
+MP3_BITRATE_BPS = 48000
+# main.py 和 txt2video 默认共用项目根目录下的缓存
+DEFAULT_TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tts")
+
+_default_cache = None
+
+
+class TTSCache(DiskCache):
+    """
+    语音合成结果缓存：key 为 (文本, 音色, 音调, 音量, 合成后端版本) 的哈希，
+    音频存为 root/ab/<key>.mp3，时长和逐词时间戳存为同名 .json，按总字节数 LRU 淘汰
+    """
+
+    label = "语音缓存"
+    probe_exts = (".mp3",)
+
+    def __init__(self, root=DEFAULT_TTS_CACHE_DIR, max_bytes=512 * 1024 ** 2):
+        super().__init__(root, max_bytes=max_bytes, sidecar_ext=".json")
+
+    @staticmethod
+    def make_key(text, voice, pitch, volume, engine):
+        data = json.dumps([text, voice, int(pitch), round(float(volume), 3), engine], ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    # 命中时返回 (音频路径, 元数据)，否则返回 None
+    def lookup(self, text, voice, pitch, volume, engine):
+        path = self.get(self.make_key(text, voice, pitch, volume, engine))
+        if path is None:
+            return None
+        try:
+            with open(self.sidecar_path(path), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        return path, meta
+
+    def save(self, text, voice, pitch, volume, engine, audio_path, meta, move=False):
+        key = self.make_key(text, voice, pitch, volume, engine)
+        sidecar = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        return self.put_file(key, audio_path, sidecar=sidecar, move=move)
+
+    def save_bytes(self, text, voice, pitch, volume, engine, audio_bytes, meta):
+        key = self.make_key(text, voice, pitch, volume, engine)
+        sidecar = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        return self.put(key, audio_bytes, ext=".mp3", sidecar=sidecar)
+
+
+def get_tts_cache():
+    """进程内共用的语音缓存，目录和容量可由 TTS_CACHE_DIR / TTS_CACHE_MAX_MB 配置"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = TTSCache(os.getenv("TTS_CACHE_DIR", DEFAULT_TTS_CACHE_DIR),
+                                  max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", "512")) * 1024 ** 2)
+    return _default_cache
+
+
+def build_meta(text, voice, pitch, volume, audio_size, boundaries, engine):
+    return {
+        "text": text,
+        "voice": voice,
+        "pitch": pitch,
+        "volume": volume,
+        "engine_version": engine,
+        "duration": round(audio_size * 8 / MP3_BITRATE_BPS, 3),
+        "boundaries": boundaries,
+    }
@@ -1,9 +1,59 @@
+import asyncio
+import hashlib
+import io
 import json
+import logging
 import os
 import time
 import uuid
 
+import aiohttp
 import requests
+from PIL import Image
+
+from image_score import score_candidates
+from workflow import load_workflow, workflow_signature
+
+logger = logging.getLogger(__name__)
+
+
+class ComfyExecutionError(RuntimeError):
+    """后端报告任务执行失败（显存不足、缺少模型或节点等），换一个后端可能成功"""
+
+
+def make_seed():
+    """基于时间戳生成16位随机种子"""
+    # 基于时间戳生成UUID
+    u = uuid.uuid1(int(time.time() * 1000))
+
+    # 将UUID转换为16位数字
+    # 取UUID的int表示，然后取模确保16位
+    num = abs(u.int) % (10 ** 16)
+    return num if num >= 10 ** 15 else num + 10 ** 15
+
+
+def stable_seed(*parts):
+    """由提示词等内容派生固定的16位种子，相同输入得到相同种子，便于命中图片缓存"""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    num = int(digest, 16) % (10 ** 16)
+    return num if num >= 10 ** 15 else num + 10 ** 15
+
+
+def build_prompt(prompt_text, work_path, negative=None, seed=None, width=None, height=None, batch_size=None):
+    """按缓存的工作流模板生成提交用的 prompt，未指定 seed 时随机生成"""
+    template = load_workflow(work_path)
+    return template.patch(f"{prompt_text},White background,jianbihua",
+                          negative=negative,
+                          seed=make_seed() if seed is None else seed,
+                          width=width, height=height, batch_size=batch_size)
+
+
+def comfy_base_url(url):
+    """WORK_URL 形如 http://host:8188/prompt，去掉接口路径得到服务根地址"""
+    url = url.rstrip("/")
+    if url.endswith("/prompt"):
+        url = url[:-len("/prompt")]
+    return url
 
 
 class TextToImg:
@@ -27,21 +77,8 @@ class TextToImg:
         return latest_image
 
     # 开始生成图像，前端UI定义所需变量传递给json
-    def generate_image(self, prompt1,work_path):
-        file = str(work_path)
-        with open(file, "r", encoding="utf-8") as file_json:
-            prompt = json.load(file_json)
-            prompt["6"]["inputs"]["text"] = f"{prompt1},White background,jianbihua"
-            # 设置seed为当前时间戳（秒级）
-            if "seed" in prompt["3"]["inputs"]:
-                # 基于时间戳生成UUID
-                u = uuid.uuid1(int(time.time() * 1000))
-
-                # 将UUID转换为16位数字
-                # 取UUID的int表示，然后取模确保16位
-                num = abs(u.int) % (10 ** 16)
-
-                prompt["3"]["inputs"]["seed"] = num if num >= 10 ** 15 else num + 10 ** 15
+    def generate_image(self, prompt1,work_path, negative=None):
+        prompt = build_prompt(prompt1, work_path, negative=negative)
         previous_image = self.get_latest_image(self.OUTPUT_DIR)  # 推理出的最新输出图像保存到指定的OUTPUT_DIR变量路径
         self.start_queue(prompt)
         # 这是一个循环获取指定路径的最新图像，休眠·一秒钟后继续循环
@@ -59,6 +96,723 @@ class TextToImg:
 
 
 
+class _ScheduledJob:
+    def __init__(self, signature, submit, future, seq):
+        self.signature = signature
+        self.submit = submit
+        self.future = future
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+
+class JobScheduler:
+    """
+    图片任务调度器：提交前把待提交的任务按工作流模型签名（checkpoint + LoRA 及强度）分组，
+    同一签名的任务连续提交，减少 ComfyUI 在任务之间切换/重新打补丁模型的次数。
+    公平性约束：其他签名有任务等待时，同一签名最多连续提交 max_batch 个，
+    或者其他签名最早的任务已等待超过 max_wait 秒，就切换到等待最久的任务。
+    只有同时排队的任务使用不同的工作流时才会重排，适合多个工作流 / 多个生产者共用一个调度器；
+    main.py 单次运行的全部插画共用 WORK_PATH，不使用调度器。
+    """
+
+    def __init__(self, max_batch=8, max_wait=30, gather_window=0.05):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # 收到第一个任务后稍等片刻，让同时入队的任务一起参与排序
+        self.gather_window = gather_window
+        self.submitted = 0
+        self.switches = 0
+        self.fifo_switches = 0
+        self._pending = []
+        self._seq = 0
+        self._task = None
+        self._last_signature = None
+        self._last_arrival_signature = None
+        self._consecutive = 0
+
+    # 排队等待调度，轮到时调用 submit() 提交，返回其结果（prompt_id）
+    async def schedule(self, prompt_workflow, submit):
+        signature = workflow_signature(prompt_workflow)
+        # 按到达顺序直接提交时会发生的切换次数，用于统计节省的切换
+        if self._last_arrival_signature is not None and signature != self._last_arrival_signature:
+            self.fifo_switches += 1
+        self._last_arrival_signature = signature
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._pending.append(_ScheduledJob(signature, submit, future, self._seq))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        return await future
+
+    def _next_job(self):
+        others = [job for job in self._pending if job.signature != self._last_signature]
+        same = [job for job in self._pending if job.signature == self._last_signature]
+        if same:
+            if not others:
+                return same[0]
+            waited = time.monotonic() - others[0].enqueued_at
+            if self._consecutive < self.max_batch and waited < self.max_wait:
+                return same[0]
+        # 切换签名：选择等待最久的其他签名任务
+        return others[0]
+
+    async def _dispatch(self):
+        await asyncio.sleep(self.gather_window)
+        while self._pending:
+            job = self._next_job()
+            self._pending.remove(job)
+            if job.future.cancelled():
+                continue
+            if job.signature == self._last_signature:
+                self._consecutive += 1
+            else:
+                if self._last_signature is not None:
+                    self.switches += 1
+                self._last_signature = job.signature
+                self._consecutive = 1
+            try:
+                result = await job.submit()
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            self.submitted += 1
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "model_switches": self.switches,
+            "switches_avoided": max(self.fifo_switches - self.switches, 0),
+        }
+
+
+class AsyncTextToImg:
+    """
+    异步 ComfyUI 客户端：
+    - 复用同一个 aiohttp 会话，保持 HTTP 长连接
+    - 所有提示词一次性入队，充分利用 ComfyUI 自身的队列
+    - 按 ComfyUI 返回的 prompt_id 跟踪任务，而不是扫描 OUTPUT_DIR 找最新文件
+    - completion="ws" 时监听 /ws 的执行事件，SaveImage 节点一执行完就返回；
+      WebSocket 断开时退回到轮询 /history/{prompt_id}
+    - fetch 决定结果的取回方式：
+        "path"  直接返回 OUTPUT_DIR 下的本地路径（ComfyUI 与本机共享文件系统）
+        "bytes" 通过 /view 接口把图片读进内存，返回 BytesIO，不在本地落盘
+        "image" 同上，但返回解码好的 PIL.Image
+    - 传入 cache（ImageCache）时先查缓存：reuse_cached=True 使用由提示词派生的固定种子，
+      相同提示词直接复用缓存图片；reuse_cached=False 每次使用新种子重新生成
+    - 传入 scheduler（JobScheduler）时按模型签名分组后再提交，多个客户端可共用一个调度器
+    """
+
+    def __init__(self, URL, OUTPUT_DIR, max_connections=8, poll_interval=0.5, timeout=600,
+                 completion="ws", on_progress=None, history_check_interval=5, fetch="path",
+                 cache=None, reuse_cached=True, scheduler=None):
+        self.URL = URL
+        self.OUTPUT_DIR = OUTPUT_DIR
+        self.base_url = comfy_base_url(URL)
+        self.client_id = uuid.uuid4().hex
+        self.max_connections = max_connections
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.completion = completion
+        if fetch not in ("path", "bytes", "image"):
+            raise ValueError(f"不支持的图片取回方式: {fetch}")
+        if fetch == "path" and OUTPUT_DIR is None:
+            raise ValueError("fetch=\"path\" 需要指定 OUTPUT_DIR（ComfyUI 的输出目录）")
+        self.fetch = fetch
+        self.cache = cache
+        self.reuse_cached = reuse_cached
+        self.scheduler = scheduler
+        self._submit_lock = asyncio.Lock()
+        # 进度回调 on_progress(prompt_id, info)，info 为 {"value", "max", "node"}
+        self.on_progress = on_progress
+        # WebSocket 模式下兜底检查 /history 的间隔，防止事件丢失
+        self.history_check_interval = history_check_interval
+        # 每个任务最近一次的进度，供网页端和日志读取
+        self.progress = {}
+        self._session = None
+        self._ws_task = None
+        self._ws_connected = asyncio.Event()
+        self._waiters = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        if self.completion == "ws" and self._ws_task is None:
+            self._ws_task = asyncio.create_task(self._listen())
+            # 先连上 WebSocket 再提交任务，避免错过执行事件；连不上也不阻塞，后续走轮询
+            try:
+                await asyncio.wait_for(self._ws_connected.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                logger.debug("ComfyUI WebSocket 连接超时，先使用 /history 轮询")
+        return self._session
+
+    async def close(self):
+        if self._ws_task is not None:
+            self._ws_task.cancel()
+            try:
+                await self._ws_task
+            except asyncio.CancelledError:
+                pass
+            self._ws_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # 持续监听 /ws 的执行事件，断线后自动重连
+    async def _listen(self):
+        ws_url = self.base_url.replace("http://", "ws://").replace("https://", "wss://")
+        failures = 0
+        while True:
+            try:
+                async with self._session.ws_connect(f"{ws_url}/ws?clientId={self.client_id}", heartbeat=30) as ws:
+                    self._ws_connected.set()
+                    failures = 0
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._handle_event(json.loads(msg.data))
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if failures == 0:
+                    logger.warning(f"ComfyUI WebSocket 连接异常，改用 /history 轮询: {e}")
+            self._ws_connected.clear()
+            failures += 1
+            await asyncio.sleep(min(2 ** failures, 30))
+
+    def _waiter(self, prompt_id):
+        if prompt_id not in self._waiters:
+            self._waiters[prompt_id] = asyncio.get_running_loop().create_future()
+        return self._waiters[prompt_id]
+
+    def _handle_event(self, event):
+        data = event.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        event_type = event.get("type")
+        if not prompt_id:
+            return
+        if event_type == "progress":
+            info = {"value": data.get("value"), "max": data.get("max"), "node": data.get("node")}
+            self.progress[prompt_id] = info
+            logger.debug(f"ComfyUI 任务 {prompt_id} 进度 {info['value']}/{info['max']}")
+            if self.on_progress:
+                self.on_progress(prompt_id, info)
+        elif event_type == "executed":
+            images = [img for img in (data.get("output") or {}).get("images", [])
+                      if img.get("type", "output") == "output"]
+            waiter = self._waiter(prompt_id)
+            if images and not waiter.done():
+                waiter.set_result(images)
+        elif event_type == "execution_error":
+            waiter = self._waiter(prompt_id)
+            if not waiter.done():
+                waiter.set_exception(ComfyExecutionError(f"ComfyUI 任务执行失败: {data.get('exception_message')}"))
+        elif event_type == "executing" and data.get("node") is None:
+            # 整个工作流执行结束但没有收到图片（例如全部命中缓存），交给 /history 确认
+            waiter = self._waiter(prompt_id)
+            if not waiter.done():
+                waiter.set_result(None)
+
+    # 按工作流模板填入提示词与随机种子，batch_size > 1 时一次采样生成多张候选图
+    def build_prompt(self, prompt_text, work_path, negative=None, width=None, height=None, batch_size=None):
+        seed = None
+        if self.cache is not None and self.reuse_cached:
+            seed = stable_seed(load_workflow(work_path).content_hash, prompt_text, negative, width, height, batch_size)
+        return build_prompt(prompt_text, work_path, negative=negative, seed=seed, width=width, height=height,
+                            batch_size=batch_size)
+
+    # 生成 prompt 并查询缓存，返回 (prompt, 缓存 key, 命中的结果或 None)
+    def prepare(self, prompt_text, work_path, negative=None, width=None, height=None, batch_size=None):
+        prompt_workflow = self.build_prompt(prompt_text, work_path, negative, width, height, batch_size)
+        if self.cache is None:
+            return prompt_workflow, None, None
+        cache_key = self.cache.make_key(prompt_workflow)
+        cached_path = self.cache.get(cache_key)
+        return prompt_workflow, cache_key, self.load_cached(cached_path) if cached_path else None
+
+    # 按 fetch 方式读取缓存中的图片
+    def load_cached(self, path):
+        if self.fetch == "path":
+            return path
+        with open(path, "rb") as f:
+            buffer = io.BytesIO(f.read())
+        return self._decode(buffer)
+
+    # 提交工作流到队列，返回 prompt_id
+    async def submit(self, prompt_workflow):
+        session = await self.open()
+        payload = {"prompt": prompt_workflow, "client_id": self.client_id}
+        async with session.post(f"{self.base_url}/prompt", json=payload) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status != 200 or "prompt_id" not in data:
+                raise RuntimeError(f"ComfyUI 提交任务失败({resp.status}): {data}")
+        prompt_id = data["prompt_id"]
+        if self.completion == "ws":
+            self._waiter(prompt_id)
+        return prompt_id
+
+    # 经调度器（或按调用顺序）提交任务，返回 prompt_id
+    async def submit_scheduled(self, prompt_workflow):
+        if self.scheduler is not None:
+            return await self.scheduler.schedule(prompt_workflow, lambda: self.submit(prompt_workflow))
+        async with self._submit_lock:
+            return await self.submit(prompt_workflow)
+
+    # 查询队列长度（运行中 + 等待中）
+    async def get_queue_length(self):
+        session = await self.open()
+        async with session.get(f"{self.base_url}/queue", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None)
+        return len(data.get("queue_running", [])) + len(data.get("queue_pending", []))
+
+    # 健康检查：/system_stats 能正常返回即认为可用
+    async def check_health(self):
+        session = await self.open()
+        try:
+            async with session.get(f"{self.base_url}/system_stats", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                return resp.status == 200
+        except Exception:
+            return False
+
+    # 尽力从队列中删除任务并中断正在执行的任务，用于超时后改投其他后端
+    async def cancel(self, prompt_id):
+        session = await self.open()
+        try:
+            async with session.post(f"{self.base_url}/queue", json={"delete": [prompt_id]},
+                                    timeout=aiohttp.ClientTimeout(total=5)):
+                pass
+            async with session.post(f"{self.base_url}/interrupt", timeout=aiohttp.ClientTimeout(total=5)):
+                pass
+        except Exception as e:
+            logger.debug(f"取消 ComfyUI 任务失败 {prompt_id}: {e}")
+
+    # 查询某个任务的历史记录，未完成时返回 None
+    async def get_history(self, prompt_id):
+        session = await self.open()
+        async with session.get(f"{self.base_url}/history/{prompt_id}") as resp:
+            if resp.status != 200:
+                return None
+            data = await resp.json(content_type=None)
+        return data.get(prompt_id)
+
+    # 从历史记录中取出所有输出图片的信息 (filename/subfolder/type)
+    @staticmethod
+    def output_images(history):
+        images = []
+        for node_output in history.get("outputs", {}).values():
+            images.extend(img for img in node_output.get("images", []) if img.get("type", "output") == "output")
+        return images
+
+    def resolve_output(self, image):
+        return os.path.join(self.OUTPUT_DIR, image.get("subfolder", ""), image["filename"])
+
+    # 通过 /view 接口把输出图片流式读入内存
+    async def fetch_output(self, image):
+        session = await self.open()
+        params = {"filename": image["filename"], "subfolder": image.get("subfolder", ""),
+                  "type": image.get("type", "output")}
+        buffer = io.BytesIO()
+        async with session.get(f"{self.base_url}/view", params=params) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"ComfyUI 获取图片失败({resp.status}): {image['filename']}")
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                buffer.write(chunk)
+        buffer.seek(0)
+        return buffer
+
+    # 按 fetch 方式把输出图片信息转换成路径 / BytesIO / PIL.Image，传入 cache_key 时同时写入缓存
+    async def load_output(self, image, cache_key=None):
+        if self.fetch == "path":
+            path = self.resolve_output(image)
+            if cache_key and self.cache is not None:
+                self.cache.put_file(cache_key, path)
+            return path
+        buffer = await self.fetch_output(image)
+        if cache_key and self.cache is not None:
+            self.cache.put(cache_key, buffer.getvalue(), os.path.splitext(image["filename"])[1] or ".png")
+        return self._decode(buffer)
+
+    def _decode(self, buffer):
+        if self.fetch == "bytes":
+            return buffer
+        img = Image.open(buffer)
+        img.load()
+        return img
+
+    # 把 load_output 的结果打开为 PIL.Image（用于打分）
+    @staticmethod
+    def open_loaded(loaded):
+        if isinstance(loaded, Image.Image):
+            return loaded
+        img = Image.open(loaded)
+        img.load()
+        if isinstance(loaded, io.BytesIO):
+            loaded.seek(0)
+        return img
+
+    # 读取同一批次的全部候选图并打分，按分数从高到低返回；最佳候选写入缓存
+    async def load_candidates(self, images, cache_key=None):
+        loaded = [await self.load_output(image) for image in images]
+        scores = score_candidates([self.open_loaded(item) for item in loaded])
+        candidates = sorted(({"image": item, "filename": image["filename"], "subfolder": image.get("subfolder", ""),
+                              **score} for image, item, score in zip(images, loaded, scores)),
+                            key=lambda candidate: candidate["score"], reverse=True)
+        if cache_key and self.cache is not None:
+            best = candidates[0]["image"]
+            if self.fetch == "path":
+                self.cache.put_file(cache_key, best)
+            elif self.fetch == "bytes":
+                self.cache.put(cache_key, best.getvalue(), os.path.splitext(candidates[0]["filename"])[1] or ".png")
+            else:
+                buffer = io.BytesIO()
+                best.save(buffer, format="PNG")
+                self.cache.put(cache_key, buffer.getvalue(), ".png")
+        return candidates
+
+    # 缓存命中时只有最佳候选，重新打分后包装成与 load_candidates 相同的结构
+    def cached_candidates(self, cached):
+        score = score_candidates([self.open_loaded(cached)])[0]
+        return [{"image": cached, "filename": None, "subfolder": None, "cached": True, **score}]
+
+    # 检查一次历史记录，完成时返回图片信息列表，未完成返回 None
+    async def check_history(self, prompt_id):
+        history = await self.get_history(prompt_id)
+        if not history:
+            return None
+        status = history.get("status", {})
+        if status.get("status_str") == "error":
+            raise ComfyExecutionError(f"ComfyUI 任务执行失败: {prompt_id}")
+        images = self.output_images(history)
+        if images or status.get("completed"):
+            if not images:
+                raise ComfyExecutionError(f"ComfyUI 任务没有输出图片: {prompt_id}")
+            return images
+        return None
+
+    # 等待任务完成，返回输出图片信息列表
+    async def wait_for_images(self, prompt_id):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            while loop.time() < deadline:
+                if self.completion == "ws" and self._ws_connected.is_set():
+                    # 事件驱动：等待 WebSocket 回调，隔一段时间兜底查一次 /history
+                    waiter = self._waiter(prompt_id)
+                    if waiter.done():
+                        # 已收到执行结束事件但没有图片，改为轮询 /history 确认
+                        await asyncio.sleep(self.poll_interval)
+                    else:
+                        await asyncio.wait({waiter}, timeout=min(self.history_check_interval,
+                                                                 max(deadline - loop.time(), 0)))
+                    if waiter.done() and waiter.result():
+                        return waiter.result()
+                else:
+                    await asyncio.sleep(self.poll_interval)
+                images = await self.check_history(prompt_id)
+                if images:
+                    return images
+            raise asyncio.TimeoutError(f"等待 ComfyUI 任务超时: {prompt_id}")
+        finally:
+            self._waiters.pop(prompt_id, None)
+            self.progress.pop(prompt_id, None)
+
+    async def _collect(self, index, prompt_id, cache_key=None, candidates=False):
+        images = await self.wait_for_images(prompt_id)
+        if candidates:
+            return index, await self.load_candidates(images, cache_key)
+        return index, await self.load_output(images[0], cache_key)
+
+    async def _run_job(self, index, prompt_workflow, cache_key=None, candidates=False):
+        prompt_id = await self.submit_scheduled(prompt_workflow)
+        return await self._collect(index, prompt_id, cache_key, candidates)
+
+    @staticmethod
+    async def _ready(index, result):
+        return index, result
+
+    # 生成单张图片，返回图片路径（或按 fetch 方式返回内存中的图片）
+    async def generate_image(self, prompt_text, work_path, negative=None, width=None, height=None):
+        prompt_workflow, cache_key, cached = self.prepare(prompt_text, work_path, negative, width, height)
+        if cached is not None:
+            return cached
+        _, path = await self._run_job(0, prompt_workflow, cache_key)
+        return path
+
+    # 先把全部提示词入队，再按完成顺序逐个产出 (序号, 图片)
+    # negative_texts 与 prompt_texts 一一对应，可为 None
+    async def generate_many(self, prompt_texts, work_path, negative_texts=None, width=None, height=None):
+        negative_texts = negative_texts or [None] * len(prompt_texts)
+        tasks = []
+        for index, (prompt_text, negative) in enumerate(zip(prompt_texts, negative_texts)):
+            prompt_workflow, cache_key, cached = self.prepare(prompt_text, work_path, negative, width, height)
+            if cached is not None:
+                tasks.append(asyncio.create_task(self._ready(index, cached)))
+            else:
+                tasks.append(asyncio.create_task(self._run_job(index, prompt_workflow, cache_key)))
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # 每个分镜通过 EmptyLatentImage 的 batch_size 一次采样生成 count 张候选图，
+    # 按完成顺序产出 (序号, 候选列表)，候选列表按分数从高到低排列，第一个即自动选中的图片
+    async def generate_candidates(self, prompt_texts, work_path, negative_texts=None, width=None, height=None,
+                                  count=4):
+        negative_texts = negative_texts or [None] * len(prompt_texts)
+        tasks = []
+        for index, (prompt_text, negative) in enumerate(zip(prompt_texts, negative_texts)):
+            prompt_workflow, cache_key, cached = self.prepare(prompt_text, work_path, negative, width, height, count)
+            if cached is not None:
+                tasks.append(asyncio.create_task(self._ready(index, self.cached_candidates(cached))))
+            else:
+                tasks.append(asyncio.create_task(self._run_job(index, prompt_workflow, cache_key, True)))
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class ComfyBackend:
+    """ComfyPool 中的单个后端，记录健康状态和吞吐统计"""
+
+    def __init__(self, client):
+        self.client = client
+        self.healthy = True
+        self.unhealthy_until = 0
+        self.inflight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def url(self):
+        return self.client.base_url
+
+    def mark_unhealthy(self, cooldown):
+        self.healthy = False
+        self.unhealthy_until = time.monotonic() + cooldown
+        logger.warning(f"ComfyUI 后端 {self.url} 暂时移出轮换 {cooldown}s")
+
+
+class ComfyPool:
+    """
+    多个 ComfyUI 后端组成的生成池，接口与 AsyncTextToImg 一致：
+    - 每个任务投递到 /queue 报告队列最短的健康后端
+    - 提交失败或查询失败的后端移出轮换，冷却后通过 /system_stats 重新探测
+    - 任务超时、或后端报告执行失败（显存不足、缺少模型等）时改投其他后端
+    - stats() 返回每个后端的吞吐统计
+    - cache / reuse_cached 与 AsyncTextToImg 相同，命中缓存的任务不会投递到任何后端
+    - scheduler 与 AsyncTextToImg 相同，首次投递按模型签名分组排序
+    """
+
+    def __init__(self, URLS, OUTPUT_DIR=None, fetch="bytes", job_timeout=300, max_attempts=3,
+                 unhealthy_cooldown=30, cache=None, reuse_cached=True, scheduler=None, **client_kwargs):
+        if fetch == "path" and OUTPUT_DIR is None:
+            raise ValueError("fetch=\"path\" 需要指定 OUTPUT_DIR（ComfyUI 的输出目录）")
+        self.backends = [ComfyBackend(AsyncTextToImg(url, OUTPUT_DIR, fetch=fetch, timeout=job_timeout,
+                                                     cache=cache, reuse_cached=reuse_cached, **client_kwargs))
+                         for url in URLS]
+        if not self.backends:
+            raise ValueError("ComfyPool 至少需要一个后端")
+        self.max_attempts = max_attempts
+        self.unhealthy_cooldown = unhealthy_cooldown
+        self.scheduler = scheduler
+        self._submit_lock = asyncio.Lock()
+        self._started_at = time.monotonic()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        self._started_at = time.monotonic()
+        await asyncio.gather(*(backend.client.open() for backend in self.backends))
+        await self.health_check()
+
+    async def close(self):
+        await asyncio.gather(*(backend.client.close() for backend in self.backends))
+
+    # 探测已过冷却期的不健康后端，恢复可用的后端
+    async def health_check(self, force=True):
+        now = time.monotonic()
+        candidates = [b for b in self.backends if force or (not b.healthy and b.unhealthy_until <= now)]
+        results = await asyncio.gather(*(b.client.check_health() for b in candidates))
+        for backend, ok in zip(candidates, results):
+            if ok:
+                if not backend.healthy:
+                    logger.info(f"ComfyUI 后端 {backend.url} 恢复可用")
+                backend.healthy = True
+            else:
+                backend.mark_unhealthy(self.unhealthy_cooldown)
+
+    # 选择队列最短的健康后端
+    async def pick_backend(self, exclude=()):
+        await self.health_check(force=False)
+        candidates = [b for b in self.backends if b.healthy and b not in exclude]
+        if not candidates:
+            # 没有其他可选后端时允许重试已尝试过的健康后端
+            candidates = [b for b in self.backends if b.healthy]
+        if not candidates:
+            raise RuntimeError("没有可用的 ComfyUI 后端")
+
+        lengths = await asyncio.gather(*(b.client.get_queue_length() for b in candidates),
+                                       return_exceptions=True)
+        best, best_key = None, None
+        for backend, length in zip(candidates, lengths):
+            if isinstance(length, Exception):
+                backend.mark_unhealthy(self.unhealthy_cooldown)
+                continue
+            key = (length, backend.inflight)
+            if best_key is None or key < best_key:
+                best, best_key = backend, key
+        if best is None:
+            raise RuntimeError("没有可用的 ComfyUI 后端")
+        return best
+
+    def prepare(self, prompt_text, work_path, negative=None, width=None, height=None, batch_size=None):
+        return self.backends[0].client.prepare(prompt_text, work_path, negative, width, height, batch_size)
+
+    # 选择队列最短的后端并提交，返回 (后端, prompt_id)
+    async def _submit_best(self, prompt_workflow, tried):
+        # 串行化“选后端 + 提交”，保证每次选择时看到的是最新的队列长度
+        async with self._submit_lock:
+            backend = await self.pick_backend(exclude=tried)
+            tried.append(backend)
+            try:
+                return backend, await backend.client.submit(prompt_workflow)
+            except Exception:
+                backend.failed += 1
+                backend.mark_unhealthy(self.unhealthy_cooldown)
+                raise
+
+    # 执行单个任务，失败或超时后改投其他后端
+    async def run(self, prompt_workflow, cache_key=None, candidates=False):
+        tried = []
+        last_error = None
+        for attempt in range(self.max_attempts):
+            try:
+                if attempt == 0 and self.scheduler is not None:
+                    backend, prompt_id = await self.scheduler.schedule(
+                        prompt_workflow, lambda: self._submit_best(prompt_workflow, tried))
+                else:
+                    backend, prompt_id = await self._submit_best(prompt_workflow, tried)
+            except Exception as e:
+                last_error = e
+                continue
+            backend.inflight += 1
+            started = time.monotonic()
+            try:
+                images = await backend.client.wait_for_images(prompt_id)
+                if candidates:
+                    result = await backend.client.load_candidates(images, cache_key)
+                else:
+                    result = await backend.client.load_output(images[0], cache_key)
+            except asyncio.TimeoutError as e:
+                backend.timeouts += 1
+                backend.mark_unhealthy(self.unhealthy_cooldown)
+                await backend.client.cancel(prompt_id)
+                logger.warning(f"ComfyUI 后端 {backend.url} 任务超时，改投其他后端")
+                last_error = e
+                continue
+            except aiohttp.ClientError as e:
+                backend.failed += 1
+                backend.mark_unhealthy(self.unhealthy_cooldown)
+                last_error = e
+                continue
+            except ComfyExecutionError as e:
+                # 后端仍然可用，只是这个任务在它上面执行失败：不移出轮换，换一个后端重试
+                backend.failed += 1
+                logger.warning(f"ComfyUI 后端 {backend.url} 执行失败，改投其他后端: {e}")
+                last_error = e
+                continue
+            finally:
+                backend.inflight -= 1
+            backend.completed += 1
+            backend.busy_seconds += time.monotonic() - started
+            return result
+        raise RuntimeError(f"ComfyUI 任务在 {self.max_attempts} 次尝试后仍然失败: {last_error}")
+
+    async def generate_image(self, prompt_text, work_path, negative=None, width=None, height=None):
+        prompt_workflow, cache_key, cached = self.prepare(prompt_text, work_path, negative, width, height)
+        if cached is not None:
+            return cached
+        return await self.run(prompt_workflow, cache_key)
+
+    # 与 AsyncTextToImg.generate_many 一致：全部入队，按完成顺序产出 (序号, 图片)
+    async def generate_many(self, prompt_texts, work_path, negative_texts=None, width=None, height=None):
+        async def job(index, prompt_text, negative):
+            prompt_workflow, cache_key, cached = self.prepare(prompt_text, work_path, negative, width, height)
+            if cached is not None:
+                return index, cached
+            return index, await self.run(prompt_workflow, cache_key)
+
+        negative_texts = negative_texts or [None] * len(prompt_texts)
+        tasks = [asyncio.create_task(job(index, prompt_text, negative))
+                 for index, (prompt_text, negative) in enumerate(zip(prompt_texts, negative_texts))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # 与 AsyncTextToImg.generate_candidates 一致
+    async def generate_candidates(self, prompt_texts, work_path, negative_texts=None, width=None, height=None,
+                                  count=4):
+        client = self.backends[0].client
+
+        async def job(index, prompt_text, negative):
+            prompt_workflow, cache_key, cached = self.prepare(prompt_text, work_path, negative, width, height, count)
+            if cached is not None:
+                return index, client.cached_candidates(cached)
+            return index, await self.run(prompt_workflow, cache_key, candidates=True)
+
+        negative_texts = negative_texts or [None] * len(prompt_texts)
+        tasks = [asyncio.create_task(job(index, prompt_text, negative))
+                 for index, (prompt_text, negative) in enumerate(zip(prompt_texts, negative_texts))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # 每个后端的吞吐统计
+    def stats(self):
+        elapsed = max(time.monotonic() - self._started_at, 1e-6)
+        return [{
+            "url": backend.url,
+            "healthy": backend.healthy,
+            "inflight": backend.inflight,
+            "completed": backend.completed,
+            "failed": backend.failed,
+            "timeouts": backend.timeouts,
+            "avg_seconds": round(backend.busy_seconds / backend.completed, 2) if backend.completed else None,
+            "images_per_minute": round(backend.completed / elapsed * 60, 2),
+        } for backend in self.backends]
+
+
 if __name__ == "__main__":
     URL = "http://localhost:8188/prompt"
     OUTPUT_DIR = r"D:\ComfyUI\ComfyUI-aki-v1.6\ComfyUI\output"
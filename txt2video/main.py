@@ -2,34 +2,52 @@ import logging
 import os
 import json
 import shutil
-import tempfile
-import uuid
 import asyncio
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Dict, Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Form
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Form, Body, Header, Response, Query
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import (
-    ImageClip, AudioFileClip, concatenate_videoclips,
-    CompositeAudioClip, afx
-)
-import edge_tts
-import numpy as np
-from scipy.io import wavfile
-from starlette.background import BackgroundTask
 from werkzeug.utils import secure_filename
 from datetime import datetime
 from urllib.parse import unquote
 
+# 复用项目根目录下的公共模块（语音缓存等）
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from tts_audio import synthesize_speech, stream_speech
+from tts_backends import resolve_voice, close_backends
+from tts_cache import get_tts_cache
+from frame_template import FrameTemplate, FrameRenderer, SAVE_FRAMES, ILLUSTRATION_SIZE
+from derived_assets import get_derived_cache
+from video_encoder import StillVideoEncoder, segment_frames
+from segment_cache import SegmentCache, get_segment_cache
+from job_queue import JobQueue, JobContext, SUCCEEDED
+from asset_store import AssetStore, MultipartUpload, UploadTooLarge, DEFAULT_INDEX_DIR
+from config_store import ConfigStore, ConfigNotFound, ConfigExists, VersionConflict, PatchError, PatchConflict
+from library_index import LibraryIndex, DEFAULT_LIBRARY_DB, probe_video
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时按修改时间同步视频库索引，新视频的时长、分辨率和海报在后台补齐（任务进程不会执行）
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, library.sync)
+    loop.run_in_executor(None, library.probe_pending)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS 支持
 from fastapi.middleware.cors import CORSMiddleware
@@ -51,10 +69,40 @@ TEMPLATES_DIR = BASE_DIR / "templates"
 CONFIG_DIR = BASE_DIR / "configs"
 PROMPT_DIR = BASE_DIR / "prompt"
 
+BGM_UPLOAD_DIR = STATIC_DIR / "uploads"
+
 for directory in [UPLOAD_DIR, STATIC_DIR, VIDEO_DIR, TEMPLATES_DIR, CONFIG_DIR]:
     os.makedirs(directory, exist_ok=True)
 
+# 上传文件按内容去重并记录引用计数，单个文件大小上限由 UPLOAD_MAX_MB 配置
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 ** 2
+# 引用计数索引放在 cache/uploads 下，不在可公开访问的 static 目录中
+image_store = AssetStore(UPLOAD_DIR, os.path.join(DEFAULT_INDEX_DIR, "images.json"), UPLOAD_MAX_BYTES)
+bgm_store = AssetStore(BGM_UPLOAD_DIR, os.path.join(DEFAULT_INDEX_DIR, "bgm.json"), UPLOAD_MAX_BYTES)
+# 上传图片的派生图（帧中插画、预览缩略图）在单独的线程中生成，不占用请求处理和渲染时间
+derive_executor = ThreadPoolExecutor(max_workers=1)
+# 生成的视频和分镜配置的索引（SQLite），首页和列表接口分页查询；海报缩略图与索引放在同一目录下
+LIBRARY_DB = os.getenv("LIBRARY_DB", DEFAULT_LIBRARY_DB)
+POSTER_DIR = Path(LIBRARY_DB).resolve().parent / "posters"
+library = LibraryIndex(LIBRARY_DB, VIDEO_DIR, CONFIG_DIR, POSTER_DIR)
+# 列表接口每页的默认条数
+LIST_PAGE_SIZE = 50
+# 分镜配置常驻内存，编辑后由后台线程延迟写盘（CONFIG_FLUSH_DELAY 秒）
+_config_store = None
+_config_store_lock = threading.Lock()
+
+
+def get_config_store():
+    """首次使用时创建配置存储：任务进程会重新导入本模块，但不会启动写盘线程和退出钩子"""
+    global _config_store
+    with _config_store_lock:
+        if _config_store is None:
+            _config_store = ConfigStore(CONFIG_DIR, flush_delay=float(os.getenv("CONFIG_FLUSH_DELAY", "0.5")),
+                                        on_change=library.update_config)
+        return _config_store
+
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/posters", StaticFiles(directory=POSTER_DIR), name="posters")
 
 # 模板配置
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
@@ -77,14 +125,18 @@ VOICE_OPTIONS = [
     {"id": "zh-CN-XiaoyiNeural", "name": "晓艺（女声）"},
     {"id": "zh-CN-YunjianNeural", "name": "云健（男声）"},
     {"id": "zh-CN-XiaoxuanNeural", "name": "晓萱（女声）"},
+    {"id": "local:zh-CN-YunxiNeural", "name": "本地离线合成（测试用）"},
 ]
 
+# 语音试听耗时统计（秒）：首字节时间、总耗时
+PREVIEW_STATS = {"count": 0, "ttfb_total": 0.0, "time_total": 0.0, "last": None}
+
 
 class SceneItem(BaseModel):
     scene_id: int
     chinese_subtitle: str
     english_subtitle: str
-    image_path: str = None
+    image_path: Optional[str] = None
     voice: str = "zh-CN-YunxiNeural"
     volume: float = 1.0
     pitch: int = 0
@@ -96,223 +148,188 @@ class VideoGenRequest(BaseModel):
     theme: str = "祥林嫂"
     bgm_path: Optional[str] = None
     bgm_volume: float = 0.3
+    # 语音合成后端（edge / local），为空时使用 TTS_BACKEND；分镜音色带 local: 等前缀时以前缀为准
+    tts_backend: Optional[str] = None
+    # 来源配置文件名，记录在视频库索引中
+    config_name: Optional[str] = None
 
 
-def wrap_text(text, font, max_width):
-    """将文本换行以适应最大宽度"""
-    lines = []
-    words = text.split()
-
-    # 如果没有空格（如中文），按字符处理
-    if len(words) == 1 and len(text) > 20:
-        words = list(text)
-
-    current_line = ""
-    for word in words:
-        test_line = f"{current_line} {word}".strip()
-        text_width = font.getlength(test_line)
-        if text_width <= max_width:
-            current_line = test_line
-        else:
-            if current_line:
-                lines.append(current_line)
-            current_line = word
-    if current_line:
-        lines.append(current_line)
-
-    return lines
-
-
-# 修改 synthesize_audio 函数
-async def synthesize_audio(text: str, output_path: str, voice: str = "zh-CN-YunxiNeural",
-                           volume: float = 1.0, pitch: int = 0):
+async def synthesize_audio(text: str, output_path: Optional[str] = None, voice: str = "zh-CN-YunxiNeural",
+                           volume: float = 1.0, pitch: int = 0, backend: Optional[str] = None):
+    """合成语音，返回内存中的 SpeechAudio（PCM 直接交给视频合成），失败返回 None"""
     try:
-        # 将 pitch 转换为字符串格式
-        pitch_str = f"+{pitch}Hz" if pitch >= 0 else f"{pitch}Hz"
-        communicate = edge_tts.Communicate(text, voice, pitch=pitch_str)
-        await communicate.save(output_path)
-
-        # 调整音量
-        if volume != 1.0:
-            rate, data = wavfile.read(output_path)
-            data = (data * volume).astype(np.int16)
-            wavfile.write(output_path, rate, data)
-
-        return True
+        return await synthesize_speech(text, voice, pitch, volume, output_path, backend=backend)
     except Exception as e:
         logger.error(f"语音生成失败: {e}")
-        return False
+        return None
 
 
-def create_frame(image_path: str, chinese_sub: str, english_sub: str,
-                 scene_number: int, theme: str = "祥林嫂", output_dir: Path = STATIC_DIR):
-    # 创建白色背景 (1080x1920)
-    bg = Image.new("RGBA", (1080, 1920), (255, 255, 255, 255))
+# 帧渲染进程池，进程数由 FRAME_WORKERS 配置（默认 CPU 核数）
+frame_renderer = FrameRenderer(font_path=STATIC_DIR / "msyh.ttc")
 
-    # 加载并调整插图大小
-    try:
-        fg = Image.open(image_path).convert('RGBA').resize((800, 800))
-        bg.paste(fg, (140, 500), fg)
-    except Exception as e:
-        logger.warning(f"无法加载图片: {str(e)}")
-        # 创建占位图像
-        placeholder = Image.new("RGBA", (800, 800), (200, 200, 200))
-        draw = ImageDraw.Draw(placeholder)
-        draw.text((300, 300), "图片加载失败", fill=(0, 0, 0))
-        bg.paste(placeholder, (140, 500))
 
-    draw = ImageDraw.Draw(bg)
+def segment_voice(text: str, voice: str, pitch: int, backend: Optional[str] = None):
+    """
+    决定旁白时长的设置（参与片段缓存的 key），音色解析规则与 synthesize_speech 相同；
+    片段只有画面，音量不影响片段内容，不参与 key
+    """
+    tts, voice = resolve_voice(voice, backend)
+    return text, voice, int(pitch), tts.version
 
-    # 加载字体
-    try:
-        theme_font = ImageFont.truetype(str(STATIC_DIR / "msyh.ttc"), 36)
-        title_font = ImageFont.truetype(str(STATIC_DIR / "msyh.ttc"), 52)
-        zh_font = ImageFont.truetype(str(STATIC_DIR / "msyh.ttc"), 40)
-        en_font = ImageFont.truetype(str(STATIC_DIR / "msyh.ttc"), 26)
-    except:
-        logger.warning("使用备用字体")
-        theme_font = ImageFont.load_default()
-        title_font = ImageFont.load_default()
-        zh_font = ImageFont.load_default()
-        en_font = ImageFont.load_default()
-
-    # 主题标题
-    draw.text((50, 30), f"本期主题：{theme}", fill=(0, 0, 0), font=theme_font)
-
-    # 分镜标题
-    title_text = f"分镜 {scene_number}"
-    title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
-    title_w = title_bbox[2] - title_bbox[0]
-    title_x = (1080 - title_w) // 2
-    draw.text((title_x, 90), title_text, fill=(0, 0, 0), font=title_font)
-
-    # 中文字幕 - 自动换行
-    max_width = 1000
-    zh_lines = wrap_text(chinese_sub, zh_font, max_width)
-    zh_y = 1400
-    for line in zh_lines:
-        line_bbox = draw.textbbox((0, 0), line, font=zh_font)
-        line_w = line_bbox[2] - line_bbox[0]
-        line_x = (1080 - line_w) // 2
-        draw.text((line_x, zh_y), line, fill=(0, 0, 0), font=zh_font)
-        zh_y += 50  # 行高
-
-    # 英文字幕 - 自动换行
-    en_lines = wrap_text(english_sub, en_font, max_width)
-    en_y = zh_y + 20
-    for line in en_lines:
-        line_bbox = draw.textbbox((0, 0), line, font=en_font)
-        line_w = line_bbox[2] - line_bbox[0]
-        line_x = (1080 - line_w) // 2
-        draw.text((line_x, en_y), line, fill=(0, 0, 0), font=en_font)
-        en_y += 30  # 行高
-
-    frame_path = output_dir / f"frame_{scene_number}.png"
-    bg.save(str(frame_path))
-    return str(frame_path)
-
-
-def create_cover_frame(cover_image_path: str, theme: str = "祥林嫂", output_dir: Path = STATIC_DIR):
-    # 创建白色背景 (1080x1920)
-    bg = Image.new("RGBA", (1080, 1920), (255, 255, 255, 255))
 
-    try:
-        # 加载封面图片
-        fg = Image.open(cover_image_path).convert('RGBA').resize((800, 800))
-        bg.paste(fg, (140, 960), fg)  # 放在下半部分
-    except Exception as e:
-        logger.warning(f"无法加载封面图片: {str(e)}")
-        # 创建占位图像
-        placeholder = Image.new("RGBA", (800, 800), (150, 150, 150))
-        draw = ImageDraw.Draw(placeholder)
-        draw.text((300, 300), "封面图片加载失败", fill=(0, 0, 0))
-        bg.paste(placeholder, (140, 960))
+# 帧以 RGB 数组直接交给视频合成，只有 SAVE_FRAMES=true 时才保存 PNG
+def cover_frame_job(cover_image_path: str, output_dir: Path = STATIC_DIR):
+    output_path = output_dir / "cover_frame.png" if SAVE_FRAMES else None
+    return "cover", cover_image_path, output_path, {"title": "祥林嫂"}
 
-    draw = ImageDraw.Draw(bg)
 
-    # 加载字体
-    try:
-        theme_font = ImageFont.truetype(str(STATIC_DIR / "msyh.ttc"), 40)
-        title_font = ImageFont.truetype(str(STATIC_DIR / "msyh.ttc"), 80)
-    except:
-        logger.warning("使用备用字体(封面)")
-        theme_font = ImageFont.load_default()
-        title_font = ImageFont.load_default()
-
-    # 添加主题标题
-    draw.text((50, 50), f"本期主题：{theme}", fill=(0, 0, 0), font=theme_font)
+def scene_frame_job(image_path: str, chinese_sub: str, english_sub: str,
+                    scene_number: int, output_dir: Path = STATIC_DIR):
+    output_path = output_dir / f"frame_{scene_number}.png" if SAVE_FRAMES else None
+    return ("scene", image_path, output_path,
+            {"title": f"分镜 {scene_number}", "zh_text": chinese_sub, "en_text": english_sub})
 
-    # 添加主标题
-    title_text = "祥林嫂"
-    title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
-    title_w = title_bbox[2] - title_bbox[0]
-    title_x = (1080 - title_w) // 2
-    draw.text((title_x, 350), title_text, fill=(0, 0, 0), font=title_font)
 
-    # 保存封面帧
-    frame_path = output_dir / "cover_frame.png"
-    bg.save(str(frame_path))
-    return str(frame_path)
+def video_item(row: dict):
+    """视频库索引中的一条视频，附加页面展示用的地址和格式化后的时长、大小"""
+    duration = row.get("duration")
+    return {
+        **row,
+        "url": f"/static/videos/{row['name']}",
+        "poster_url": f"/posters/{row['poster']}" if row.get("poster") else None,
+        "duration_text": f"{int(duration) // 60}:{int(duration) % 60:02d}" if duration else None,
+        "size_text": f"{(row.get('size') or 0) / 1024 ** 2:.1f}MB",
+        "resolution": f"{row['width']}×{row['height']}" if row.get("width") else None,
+    }
 
 
-@app.get("/", response_class=HTMLResponse)
-async def get_ui(request: Request):
-    video_files = sorted(VIDEO_DIR.glob("*.mp4"))
-    videos = [video.name for video in video_files]
+def config_item(row: dict):
+    return {**row, "path": f"/configs/{row['name']}"}
 
-    # 列出已有的配置
-    config_files = sorted(CONFIG_DIR.glob("*.json"))
-    configs = [{"name": f.name, "path": f"/configs/{f.name}"} for f in config_files]
 
-    return templates.TemplateResponse("index.html", {
-        "request": request,
+@app.get("/", response_class=HTMLResponse)
+async def get_ui(request: Request, page: int = Query(1, ge=1)):
+    # 视频和配置都从索引中分页读取，不再每次扫描目录
+    rows, total = library.videos(offset=(page - 1) * LIST_PAGE_SIZE, limit=LIST_PAGE_SIZE)
+    videos = [video_item(row) for row in rows]
+    # 页面只直接渲染第一页配置，页面加载后由 loadConfigList() 通过 /list_configs 逐页取回全部配置
+    configs = [config_item(row) for row in library.configs(limit=LIST_PAGE_SIZE)[0]]
+
+    return templates.TemplateResponse(request, "index.html", {
         "scene_data": SCENE_DATA,
         "videos": videos,
+        "video_page": page,
+        "video_pages": max(1, -(-total // LIST_PAGE_SIZE)),
+        "video_total": total,
         "voice_options": VOICE_OPTIONS,
         "configs": configs
     })
 
 
+@app.get("/videos")
+async def list_videos(offset: int = Query(0, ge=0), limit: int = Query(LIST_PAGE_SIZE, ge=1, le=500)):
+    """生成的视频，按生成时间从新到旧分页"""
+    rows, total = library.videos(offset=offset, limit=limit)
+    return {"status": "success", "videos": [video_item(row) for row in rows], "total": total,
+            "offset": offset, "limit": limit}
+
+
 @app.get("/scene_data")
 async def get_scene_data():
     return SCENE_DATA
 
 
-@app.post("/upload/{scene_id}")
-async def upload_file(scene_id: str, file: UploadFile = File(...)):
-    ext = file.filename.split('.')[-1].lower()
-    if ext not in ["png", "jpg", "jpeg", "webp", "gif"]:
-        raise HTTPException(status_code=400, detail="不支持的文件格式")
-
-    # 生成唯一文件名
-    filename = f"{'cover' if scene_id == 'cover' else f'scene_{scene_id}'}_{uuid.uuid4().hex[:8]}.{ext}"
-    file_path = UPLOAD_DIR / filename
+def check_upload_size(request: Request, store: AssetStore):
+    """请求体声明的大小已超过限制时直接拒绝，不再读取"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > store.max_bytes + 64 * 1024:
+        raise HTTPException(status_code=413, detail=str(UploadTooLarge(store.max_bytes)))
 
-    # 保存文件
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
 
-    return {"status": "success", "file_path": str(file_path), "filename": filename}
+async def save_upload(request: Request, store: AssetStore, allowed_exts):
+    """
+    从请求体流中解析 multipart 的 file 字段并直接写入存储：边接收边计算大小，
+    超过限制立即返回 413（Content-Length 缺失或不实时同样生效）；返回 (文件名, 是否为已有内容)
+    """
+    check_upload_size(request, store)
+    try:
+        upload = MultipartUpload(request.stream(), request.headers.get("content-type"))
+        filename = await upload.begin()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ext = filename.split('.')[-1].lower()
+    if ext not in allowed_exts:
+        raise HTTPException(status_code=400, detail="不支持的文件格式")
+    try:
+        return await store.save(upload.chunks(), ext)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/upload_bgm")
-async def upload_bgm(file: UploadFile = File(...)):
-    ext = file.filename.split('.')[-1].lower()
-    if ext not in ["mp3", "wav", "ogg"]:
-        raise HTTPException(status_code=400, detail="不支持的文件格式")
+@app.post("/upload/{scene_id}")
+async def upload_file(scene_id: str, request: Request):
+    # 分块写入并按内容去重，相同图片只保存一份
+    filename, duplicate = await save_upload(request, image_store, ["png", "jpg", "jpeg", "webp", "gif"])
+    asyncio.get_running_loop().run_in_executor(derive_executor, get_derived_cache().prepare,
+                                               str(UPLOAD_DIR / filename), ILLUSTRATION_SIZE)
+    return {"status": "success", "file_path": str(UPLOAD_DIR / filename), "filename": filename,
+            "duplicate": duplicate, "thumbnail_url": f"/thumbnail/{filename}"}
+
+
+@app.get("/thumbnail/{filename}")
+async def get_thumbnail(filename: str):
+    """上传图片的预览缩略图（最长边 400px），按图片内容缓存"""
+    name = image_store.name_of(filename)
+    if name is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    try:
+        path = await asyncio.get_running_loop().run_in_executor(
+            derive_executor, get_derived_cache().thumbnail, image_store.path(name))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"无法生成缩略图: {str(e)}")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=86400"})
 
-    # 生成唯一文件名
-    filename = f"bgm_{uuid.uuid4().hex[:8]}.{ext}"
-    file_path = STATIC_DIR / "uploads" / filename
 
-    # 确保目录存在
-    os.makedirs(STATIC_DIR / "uploads", exist_ok=True)
+@app.post("/upload_bgm")
+async def upload_bgm(request: Request):
+    filename, duplicate = await save_upload(request, bgm_store, ["mp3", "wav", "ogg"])
+    return {"status": "success", "file_path": f"/static/uploads/{filename}", "filename": filename,
+            "duplicate": duplicate}
+
+
+def config_error(e: Exception):
+    """配置存储的异常转换为对应的 HTTP 错误"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ConfigNotFound):
+        return HTTPException(status_code=404, detail="配置文件不存在")
+    if isinstance(e, ConfigExists):
+        return HTTPException(status_code=409, detail="配置文件已存在")
+    if isinstance(e, (VersionConflict, PatchConflict)):
+        return HTTPException(status_code=409, detail=str(e))
+    if isinstance(e, (PatchError, ValueError)):
+        return HTTPException(status_code=400, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+
+def expected_version(if_match: Optional[str]):
+    """If-Match 请求头中的版本号（与响应的 ETag 相同），未提供时不做版本检查"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的 If-Match: {if_match}")
 
-    # 保存文件
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
 
-    return {"status": "success", "file_path": f"/static/uploads/{filename}", "filename": filename}
+def versioned(response: Response, version: int, body: dict):
+    response.headers["ETag"] = f'"{version}"'
+    return {**body, "version": version}
 
 
 @app.post("/upload_config")
@@ -325,100 +342,70 @@ async def upload_config(
         if file:
             if not file.filename.endswith('.json'):
                 raise HTTPException(status_code=400, detail="仅支持JSON文件")
+            json_content = (await file.read()).decode("utf-8")
+        elif not json_content:
+            raise HTTPException(status_code=400, detail="无效的请求")
 
-            if not config_name:
-                raise HTTPException(status_code=400, detail="请输入配置名称")
-
-            # 直接使用配置名称作为文件名
-            filename = f"{config_name}.json"
-            file_path = CONFIG_DIR / filename
-
-            # 检查文件是否已存在
-            if file_path.exists():
-                raise HTTPException(status_code=409, detail="配置文件已存在")
-
-            # 保存文件
-            with open(file_path, "wb") as f:
-                f.write(await file.read())
-
-            return {"status": "success", "file_path": filename}
-
-        elif json_content:
-            try:
-                # 验证JSON格式
-                json_data = json.loads(json_content)
-
-                if not config_name:
-                    raise HTTPException(status_code=400, detail="请输入配置名称")
-
-                # 直接使用配置名称作为文件名
-                filename = f"{config_name}.json"
-                file_path = CONFIG_DIR / filename
-
-                # 检查文件是否已存在
-                if file_path.exists():
-                    raise HTTPException(status_code=409, detail="配置文件已存在")
-
-                # 保存文件
-                with open(file_path, "w", encoding="utf-8") as f:
-                    json.dump(json_data, f, ensure_ascii=False, indent=2)
-
-                return {"status": "success", "file_path": filename}
-
-            except json.JSONDecodeError as e:
-                raise HTTPException(status_code=400, detail=f"无效的JSON格式: {str(e)}")
-
-        raise HTTPException(status_code=400, detail="无效的请求")
+        if not config_name:
+            raise HTTPException(status_code=400, detail="请输入配置名称")
 
+        # 验证JSON格式
+        try:
+            json_data = json.loads(json_content)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"无效的JSON格式: {str(e)}")
+
+        # 直接使用配置名称作为文件名，已存在时返回 409
+        filename = f"{config_name}.json"
+        get_config_store().create(filename, json_data)
+        return {"status": "success", "file_path": filename}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise config_error(e)
 
 
 @app.get("/load_config/{filename}")
-async def load_config(filename: str):
+async def load_config(filename: str, response: Response):
     try:
-        file_path = CONFIG_DIR / filename
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="配置文件不存在")
-
-        with open(file_path, "r", encoding="utf-8") as f:
-            config_data = json.load(f)
-
-        return {"status": "success", "config": config_data}
+        config_data, version = get_config_store().get(filename)
+        return versioned(response, version, {"status": "success", "config": config_data})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise config_error(e)
 
 
 @app.post("/save_config/{filename}")
-async def save_config(filename: str, config_data: dict):
+async def save_config(filename: str, config_data: dict, response: Response,
+                      if_match: Optional[str] = Header(None)):
     try:
-        file_path = CONFIG_DIR / filename
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="配置文件不存在")
-
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=2)
-
-        return {"status": "success", "message": "配置保存成功"}
+        version = get_config_store().replace(filename, config_data, expected_version(if_match))
+        return versioned(response, version, {"status": "success", "message": "配置保存成功"})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise config_error(e)
 
 
-@app.post("/add_scene/{filename}")
-async def add_scene(filename: str, scene_data: dict):
+@app.patch("/configs/{filename}")
+async def patch_config(filename: str, response: Response, operations: list = Body(...),
+                       if_match: Optional[str] = Header(None)):
+    """
+    按 JSON Patch（RFC 6902）局部修改配置，例如修改第 3 个分镜的中文字幕：
+    [{"op": "replace", "path": "/分镜结构/分镜列表/2/字幕/中文", "value": "..."}]
+    带 If-Match: "<版本号>" 时只在版本一致时生效，否则返回 409；补丁整体生效或整体失败
+    """
     try:
-        file_path = CONFIG_DIR / filename
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="配置文件不存在")
+        version = get_config_store().patch(filename, operations, expected_version(if_match))
+        return versioned(response, version, {"status": "success"})
+    except Exception as e:
+        raise config_error(e)
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            config_data = json.load(f)
 
+@app.post("/add_scene/{filename}")
+async def add_scene(filename: str, scene_data: dict, response: Response,
+                    if_match: Optional[str] = Header(None)):
+    def append_scene(config_data):
+        scenes = config_data['分镜结构']['分镜列表']
         # 获取当前最大分镜编号
         max_scene_id = 0
-        for scene in config_data['分镜结构']['分镜列表']:
-            scene_id = int(scene['分镜编号'])
-            max_scene_id = max(max_scene_id, scene_id)
+        for scene in scenes:
+            max_scene_id = max(max_scene_id, int(scene['分镜编号']))
 
         # 添加新分镜
         new_scene = {
@@ -431,72 +418,61 @@ async def add_scene(filename: str, scene_data: dict):
                 "英文": ""
             }
         }
-        config_data['分镜结构']['分镜列表'].append(new_scene)
+        scenes.append(new_scene)
+        return new_scene
 
-        # 保存更新后的配置
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=2)
-
-        return {"status": "success", "scene": new_scene}
+    try:
+        new_scene, version = get_config_store().update(filename, append_scene, expected_version(if_match))
+        return versioned(response, version, {"status": "success", "scene": new_scene})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise config_error(e)
 
 
 @app.delete("/delete_scene/{filename}/{scene_id}")
-async def delete_scene(filename: str, scene_id: str):
-    try:
-        file_path = CONFIG_DIR / filename
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="配置文件不存在")
-
-        with open(file_path, "r", encoding="utf-8") as f:
-            config_data = json.load(f)
-
-        # 删除指定分镜
-        config_data['分镜结构']['分镜列表'] = [
-            scene for scene in config_data['分镜结构']['分镜列表']
-            if scene['分镜编号'] != scene_id
-        ]
-
-        # 重新编号
-        for i, scene in enumerate(config_data['分镜结构']['分镜列表'], 1):
+async def delete_scene(filename: str, scene_id: str, response: Response,
+                       if_match: Optional[str] = Header(None)):
+    def remove_scene(config_data):
+        # 删除指定分镜并重新编号
+        structure = config_data['分镜结构']
+        scenes = [scene for scene in structure['分镜列表'] if str(scene['分镜编号']) != scene_id]
+        for i, scene in enumerate(scenes, 1):
             scene['分镜编号'] = str(i)
+        structure['分镜列表'] = scenes
 
-        # 保存更新后的配置
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=2)
-
-        return {"status": "success", "message": "分镜删除成功"}
+    try:
+        _, version = get_config_store().update(filename, remove_scene, expected_version(if_match))
+        return versioned(response, version, {"status": "success", "message": "分镜删除成功"})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.post("/generate_video")
-async def generate_video(request: VideoGenRequest):
+        raise config_error(e)
+
+
+async def render_video(request: VideoGenRequest, context: JobContext):
+    """
+    生成视频（在任务进程中运行），返回视频地址：
+    - 临时文件都写在本任务独占的 context.workspace 中，并发任务互不覆盖
+    - 通过 context.report 报告进度，阶段为 tts / frames / encode_wait / encode
+    - 编码前占用一个 encode 名额，同时编码的任务数不超过 MAX_CONCURRENT_ENCODES
+    """
+    progress = context.report
+    workspace = Path(context.workspace)
+    # SAVE_FRAMES=true 时调试用的帧按任务分目录保存
+    frames_dir = STATIC_DIR / "frames" / context.id
+    if SAVE_FRAMES:
+        os.makedirs(frames_dir, exist_ok=True)
+    frames = None
+    extra_frames = None
     try:
-        clips = []
-        audio_clips = []
-        total_duration = 0
-        temp_files = []  # 用于跟踪临时文件
-
-        # 处理封面
-        cover_audio_path = VIDEO_DIR / f"cover_{uuid.uuid4().hex[:8]}.mp3"
-        temp_files.append(cover_audio_path)
-        if not await synthesize_audio("本期要讲的主题是" + request.theme, str(cover_audio_path), pitch=0):
-            raise HTTPException(status_code=500, detail="封面语音生成失败")
-
-        cover_frame_path = create_cover_frame(request.cover_image, request.theme, STATIC_DIR)
-        cover_audio_clip = AudioFileClip(str(cover_audio_path))
-        cover_duration = cover_audio_clip.duration
-        cover_clip = ImageClip(cover_frame_path).set_duration(cover_duration).set_audio(cover_audio_clip)
-        clips.append(cover_clip)
-        audio_clips.append(cover_audio_clip)
-        total_duration += cover_duration
+        # 先确定每个分镜使用的图片和旁白设置，据此算出每个分镜片段的缓存 key
+        template = FrameTemplate(request.theme, STATIC_DIR / "msyh.ttc")
+        encoder = StillVideoEncoder()
+        segment_cache = get_segment_cache()
+        cover_text = "本期要讲的主题是" + request.theme
+        frame_jobs = [cover_frame_job(request.cover_image, frames_dir)]
+        voices = [segment_voice(cover_text, "zh-CN-YunxiNeural", 0, request.tts_backend)]
+        scenes = []
 
         # 记录上一个有效的图片路径
         last_valid_image = request.cover_image
-
-        # 处理分镜
         for scene in request.scenes:
             # 如果没有上传图片，使用上一个有效的图片
             if not scene.image_path:
@@ -508,106 +484,221 @@ async def generate_video(request: VideoGenRequest):
                     continue
             else:
                 last_valid_image = scene.image_path
+            scenes.append(scene)
+            frame_jobs.append(scene_frame_job(scene.image_path, scene.chinese_subtitle, scene.english_subtitle,
+                                              scene.scene_id, frames_dir))
+            voices.append(segment_voice(scene.chinese_subtitle, scene.voice, scene.pitch, request.tts_backend))
+
+        # 只渲染片段缓存未命中的帧（修改一个分镜后重新生成只需重绘、重编码这一个分镜），与语音合成同时进行
+        keys = [SegmentCache.make_key(image, kind, options, template.spec(), voice, encoder.profile())
+                for (kind, image, _, options), voice in zip(frame_jobs, voices)]
+        cached = [segment_cache.lookup(key) for key in keys]
+        render_jobs = [job for job, hit in zip(frame_jobs, cached) if hit is None]
+        progress("frames", 0, len(render_jobs))
+        frames_task = asyncio.create_task(frame_renderer.render_async(
+            template, render_jobs, lambda done, total: progress("frames", done, total)))
 
-            audio_path = VIDEO_DIR / f"scene_{scene.scene_id}_{uuid.uuid4().hex[:8]}.mp3"
-            temp_files.append(audio_path)
-
-            # 使用场景中指定的语音设置
-            voice = scene.voice if hasattr(scene, 'voice') else "zh-CN-YunxiNeural"
-            volume = scene.volume if hasattr(scene, 'volume') else 1.0
-            pitch = scene.pitch if hasattr(scene, 'pitch') else 0
-
-            logger.info(f"生成分镜 {scene.scene_id} 的语音，使用角色: {voice}, 音量: {volume}, 音调: {pitch}")
-
-            if not await synthesize_audio(
+        try:
+            # 处理封面
+            progress("tts", 0, len(scenes) + 1)
+            cover_audio = await synthesize_audio(cover_text, pitch=0, backend=request.tts_backend)
+            if cover_audio is None:
+                raise RuntimeError("封面语音生成失败")
+            progress("tts", 1, len(scenes) + 1)
+
+            # 处理分镜
+            scene_audios = []
+            for scene in scenes:
+                # 使用场景中指定的语音设置
+                voice = scene.voice if hasattr(scene, 'voice') else "zh-CN-YunxiNeural"
+                volume = scene.volume if hasattr(scene, 'volume') else 1.0
+                pitch = scene.pitch if hasattr(scene, 'pitch') else 0
+
+                logger.info(f"生成分镜 {scene.scene_id} 的语音，使用角色: {voice}, 音量: {volume}, 音调: {pitch}")
+
+                scene_audio = await synthesize_audio(
                     scene.chinese_subtitle,
-                    str(audio_path),
                     voice=voice,
                     volume=volume,
-                    pitch=pitch
-            ):
-                logger.warning(f"分镜 {scene.scene_id} 语音生成失败，跳过")
+                    pitch=pitch,
+                    backend=request.tts_backend
+                )
+                if scene_audio is None:
+                    logger.warning(f"分镜 {scene.scene_id} 语音生成失败，跳过")
+                scene_audios.append(scene_audio)
+                progress("tts", len(scene_audios) + 1, len(scenes) + 1)
+
+            frames = await frames_task
+        except BaseException:
+            frames_task.cancel()
+            raise
+
+        # 命中缓存的分镜不需要帧，对应位置为 None
+        rendered = iter(frames)
+        all_frames = [None if hit is not None else next(rendered) for hit in cached]
+
+        # 命中的片段帧数与本次旁白时长不符（旁白被淘汰后重新合成，时长变了）时不能复用，补渲染这些帧
+        audios = [cover_audio] + scene_audios
+        stale = [index for index, (hit, audio) in enumerate(zip(cached, audios))
+                 if hit is not None and audio is not None
+                 and hit[1]["frames"] != segment_frames(audio.duration, encoder.fps)]
+        if stale:
+            logger.info(f"{len(stale)} 个缓存片段与旁白时长不符，重新编码")
+            extra_frames = await frame_renderer.render_async(template, [frame_jobs[index] for index in stale])
+            for index, frame in zip(stale, extra_frames):
+                cached[index] = None
+                all_frames[index] = frame
+
+        video_frames = [all_frames[0]]
+        video_audios = [cover_audio.pcm]
+        video_keys = [keys[0]]
+        video_cached = [cached[0]]
+        for index, (scene, scene_audio) in enumerate(zip(scenes, scene_audios), 1):
+            if scene_audio is None:
                 continue
+            video_frames.append(all_frames[index])
+            video_audios.append(scene_audio.pcm)
+            video_keys.append(keys[index])
+            video_cached.append(cached[index])
+            logger.info(f"分镜 {scene.scene_id} 处理完成")
+
+        # 背景音乐：上传接口返回的是 /static/uploads/... 形式的地址
+        bgm_path = None
+        if request.bgm_path:
+            bgm_path = Path(request.bgm_path)
+            if request.bgm_path.startswith("/static/"):
+                bgm_path = STATIC_DIR / request.bgm_path[len("/static/"):]
+            if bgm_path.exists():
+                logger.info(f"添加背景音乐，音量: {request.bgm_volume}")
+            else:
+                logger.error(f"添加背景音乐失败: 文件不存在 {request.bgm_path}")
+                bgm_path = None
+
+        # 输出视频：先写入工作目录，完成后再移入视频目录，列表中不会出现写了一半的文件
+        output_filename = f"{request.theme}_output_{context.id[:8]}.mp4"
+        video_path = workspace / output_filename
+
+        # 只编码未命中缓存的分镜片段，所有片段流复制拼接后一次性混入旁白和背景音乐
+        with context.limit("encode", "encode_wait"):
+            progress("encode", 0, None)
+            encoder.render(video_frames, video_audios, video_path, cover_audio.sample_rate, bgm_path,
+                           request.bgm_volume, video_keys, segment_cache, video_cached,
+                           lambda done, total: progress("encode", done, total), work_dir=workspace)
+        shutil.move(str(video_path), str(VIDEO_DIR / output_filename))
+
+        return f"/static/videos/{output_filename}"
+    finally:
+        if frames is not None:
+            frames.close()
+        if extra_frames is not None:
+            extra_frames.close()
+
+
+def run_video_job(payload: dict, context: JobContext):
+    """任务进程入口：payload 为 VideoGenRequest 的字段"""
+    # 按任务启动时实际运行的任务数平分 CPU 核数：只有一个任务时仍使用全部核数
+    if not os.getenv("FRAME_WORKERS"):
+        frame_renderer.max_workers = max(1, (os.cpu_count() or 1) // context.running)
+    try:
+        video_url = asyncio.run(render_video(VideoGenRequest(**payload), context))
+        # 时长、分辨率和海报在任务进程中读取，主进程只写入索引
+        name = Path(video_url).name
+        return {"video_url": video_url, "video": probe_video(VIDEO_DIR / name, library.poster_path(name))}
+    finally:
+        frame_renderer.close()
+        close_backends()
 
-            frame_path = create_frame(
-                scene.image_path,
-                scene.chinese_subtitle,
-                scene.english_subtitle,
-                scene.scene_id,
-                request.theme,
-                STATIC_DIR
-            )
 
-            try:
-                audio_clip = AudioFileClip(str(audio_path))
-                img_clip = ImageClip(frame_path).set_duration(audio_clip.duration).set_audio(audio_clip)
-                clips.append(img_clip)
-                audio_clips.append(audio_clip)
-                total_duration += audio_clip.duration
-                logger.info(f"分镜 {scene.scene_id} 处理完成")
-            except Exception as e:
-                logger.error(f"创建分镜 {scene.scene_id} clip 失败: {str(e)}")
+# 同时编码的任务数上限：编码会占满多个核，超出的任务在 encode_wait 阶段排队
+MAX_CONCURRENT_ENCODES = int(os.getenv("MAX_CONCURRENT_ENCODES", "0")) or max(1, (os.cpu_count() or 1) // 4)
 
-        if not clips:
-            raise HTTPException(status_code=400, detail="没有有效的分镜来生成视频")
+def upload_refs(path: Optional[str]):
+    """上传文件地址对应的 (存储, 文件名)，不是上传文件时返回 None"""
+    if not path:
+        return None
+    if path.startswith("/static/uploads/"):
+        store = bgm_store
+    elif Path(path).parent == UPLOAD_DIR:
+        store = image_store
+    else:
+        return None
+    name = store.name_of(path)
+    return (store, name) if name else None
 
-        # 组合所有视频片段
-        final_clip = concatenate_videoclips(clips, method="compose")
 
-        # 添加背景音乐
-        if request.bgm_path:
-            try:
-                bgm_clip = AudioFileClip(str(request.bgm_path))
-                # 循环背景音乐以匹配视频长度
-                bgm_clip = afx.audio_loop(bgm_clip, duration=total_duration)
-                # 调整音量
-                bgm_clip = bgm_clip.volumex(request.bgm_volume)
-
-                # 合并所有音频
-                all_audio = [final_clip.audio] + [bgm_clip]
-                composite_audio = CompositeAudioClip(all_audio)
-                final_clip = final_clip.set_audio(composite_audio)
-                logger.info(f"添加背景音乐，音量: {request.bgm_volume}")
-            except Exception as e:
-                logger.error(f"添加背景音乐失败: {str(e)}")
-
-        # 输出视频
-        output_filename = f"{request.theme}_output_{uuid.uuid4().hex[:8]}.mp4"
-        video_path = VIDEO_DIR / output_filename
-
-        # 写入视频文件
-        final_clip.write_videofile(
-            str(video_path),
-            fps=24,
-            codec='libx264',
-            audio_codec='aac',
-            threads=4,
-            logger="bar"
-        )
-
-        # 清理临时文件
-        for temp_file in temp_files:
-            try:
-                if temp_file.exists():
-                    os.remove(temp_file)
-                    logger.info(f"删除临时文件: {temp_file}")
-            except Exception as e:
-                logger.error(f"删除临时文件失败 {temp_file}: {str(e)}")
+def job_uploads(payload: dict):
+    paths = [payload.get("cover_image"), payload.get("bgm_path")]
+    paths += [scene.get("image_path") for scene in payload.get("scenes", [])]
+    return [ref for ref in map(upload_refs, paths) if ref]
 
-        return {"status": "success", "video_url": f"/static/videos/{output_filename}"}
 
-    except Exception as e:
-        logger.error(f"视频生成失败: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"视频生成失败: {str(e)}")
+def finish_video_job(job):
+    """任务结束：归还上传文件的引用，成功时把视频写入视频库索引"""
+    for store, name in getattr(job, "uploads", ()):
+        store.release(name)
+    if job.status == SUCCEEDED:
+        library.put_video(job.result["video"], source_config=job.payload.get("config_name"),
+                          theme=job.payload.get("theme"))
+
+
+# 视频生成任务队列：每个任务在独立进程中运行（默认同时运行 CPU 核数个），Web 服务始终保持响应
+video_jobs = JobQueue(run_video_job, limits={"encode": MAX_CONCURRENT_ENCODES}, on_finish=finish_video_job)
+
+
+@app.post("/generate_video")
+async def generate_video(request: VideoGenRequest):
+    """提交视频生成任务，立即返回任务 id；进度通过 /jobs/{job_id} 或 /jobs/{job_id}/events 查询"""
+    payload = request.model_dump()
+    # 任务执行期间持有所用上传文件的引用，期间删除这些文件不会影响任务
+    uploads = [(store, name) for store, name in job_uploads(payload) if store.acquire([name])]
+    try:
+        job = video_jobs.submit(payload)
+    except asyncio.QueueFull:
+        for store, name in uploads:
+            store.release(name)
+        raise HTTPException(status_code=429, detail="生成任务过多，请稍后再试", headers={"Retry-After": "30"})
+    job.uploads = uploads
+    return {"status": "queued", "job_id": job.id, "job": job.snapshot()}
+
+
+def get_job_or_404(job_id: str):
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return get_job_or_404(job_id).snapshot()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """以 Server-Sent Events 推送任务状态，任务结束后关闭"""
+    job = get_job_or_404(job_id)
+
+    async def stream():
+        async for snapshot in video_jobs.watch(job):
+            yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    return video_jobs.cancel(job_id).snapshot()
 
 
 @app.get("/list_configs")
-async def list_configs():
+async def list_configs(offset: int = Query(0, ge=0), limit: int = Query(LIST_PAGE_SIZE, ge=1, le=500)):
+    """分镜配置，按名称分页；configs 为文件名列表，items 附带分镜数、主题、总时长"""
     try:
-        configs = []
-        for file in CONFIG_DIR.glob("*.json"):
-            configs.append(file.name)
-        return {"status": "success", "configs": configs}
+        rows, total = library.configs(offset=offset, limit=limit)
+        return {"status": "success", "configs": [row["name"] for row in rows],
+                "items": [config_item(row) for row in rows], "total": total, "offset": offset, "limit": limit}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -637,6 +728,14 @@ async def delete_file(request: Request):
         file_path = unquote(file_path)
         logger.info(f"解码后的路径: {file_path}")
         
+        # 上传的图片和背景音乐按引用计数删除：其他分镜或正在执行的任务仍在使用时只减少引用
+        upload = upload_refs(file_path)
+        if upload:
+            store, name = upload
+            deleted = store.release(name)
+            return {"status": "success", "message": "文件删除成功" if deleted else "文件仍在使用，已移除引用",
+                    "deleted": deleted}
+
         # 处理前端发送的路径格式
         # 前端可能发送: /static/videos/filename.mp4 或 /configs/filename.json
         if file_path.startswith('/static/videos/'):
@@ -663,7 +762,16 @@ async def delete_file(request: Request):
         # 安全检查：确保路径在允许的目录内
         if not (full_path.parent == VIDEO_DIR or full_path.parent == CONFIG_DIR):
             raise HTTPException(status_code=400, detail="不允许访问该路径")
-        
+
+        # 配置文件经配置存储删除，内存中的副本和未写盘的修改一并丢弃
+        if full_path.parent == CONFIG_DIR:
+            try:
+                get_config_store().delete(filename)
+            except Exception as e:
+                raise config_error(e)
+            logger.info(f"成功删除配置: {filename}")
+            return {"status": "success", "message": "文件删除成功"}
+
         # 检查文件是否存在
         if not full_path.exists():
             logger.error(f"文件不存在: {full_path}")
@@ -676,6 +784,7 @@ async def delete_file(request: Request):
         # 删除文件
         try:
             os.remove(full_path)
+            library.remove_video(filename)
             logger.info(f"成功删除文件: {full_path}")
             return {"status": "success", "message": "文件删除成功"}
         except PermissionError:
@@ -692,40 +801,92 @@ async def delete_file(request: Request):
         raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
 
 
+async def _preview_response(text: str, voice: str, pitch: int, backend: Optional[str] = None, volume: float = 1.0):
+    if not text or not voice:
+        raise HTTPException(status_code=400, detail="缺少必要参数")
+
+    # 获取语音配置：本地后端可使用任意音色名，edge-tts 只接受列表中的音色
+    try:
+        tts, voice_name = resolve_voice(voice, backend)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if tts.name == "edge" and not any(v['id'] == voice_name for v in VOICE_OPTIONS):
+        raise HTTPException(status_code=400, detail="无效的语音ID")
+
+    if volume != 1.0:
+        # 调整音量需要完整的 PCM：与生成视频相同，经 synthesize_speech 缩放（apply_volume）后写入语音缓存
+        try:
+            audio = await synthesize_speech(text, voice, pitch, volume, backend=backend, decode=False)
+        except Exception as e:
+            logger.error(f"语音预览失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+        return FileResponse(audio.path, media_type="audio/mpeg", headers={"Cache-Control": "no-store"})
+
+    started = time.perf_counter()
+    chunks = stream_speech(text, voice, pitch, backend=backend)
+    # 先取到第一个数据块再返回响应，合成失败时仍能返回 500
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=500, detail="语音生成失败")
+    except Exception as e:
+        logger.error(f"语音预览失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    ttfb = time.perf_counter() - started
+
+    async def body():
+        completed = False
+        try:
+            yield first_chunk
+            async for data in chunks:
+                yield data
+            completed = True
+        finally:
+            await chunks.aclose()
+            total = time.perf_counter() - started
+            PREVIEW_STATS["count"] += 1
+            PREVIEW_STATS["ttfb_total"] += ttfb
+            PREVIEW_STATS["time_total"] += total
+            PREVIEW_STATS["last"] = {"ttfb": round(ttfb, 3), "total": round(total, 3), "completed": completed}
+            logger.info(f"语音预览: 首字节 {ttfb * 1000:.0f}ms, 总耗时 {total * 1000:.0f}ms"
+                        f"{'' if completed else '（客户端中断）'}")
+
+    return StreamingResponse(body(), media_type="audio/mpeg", headers={"Cache-Control": "no-store"})
+
+
+@app.get("/preview_voice")
+async def preview_voice_stream(text: str, voice: str, pitch: int = 0, backend: Optional[str] = None,
+                               volume: float = 1.0):
+    """
+    试听：音量为 1 时流式返回，其他音量与生成视频时一样在服务端缩放并限制峰值（apply_volume），
+    试听和成片的响度一致；合成结果写入语音缓存，生成视频时直接复用
+    """
+    return await _preview_response(text, voice, pitch, backend, volume)
+
+
 @app.post("/preview_voice")
 async def preview_voice(
         text: str = Form(...),
         voice: str = Form(...),
         volume: float = Form(1.0),
-        pitch: int = Form(0)
+        pitch: int = Form(0),
+        backend: Optional[str] = Form(None)
 ):
-    try:
-        if not text or not voice:
-            raise HTTPException(status_code=400, detail="缺少必要参数")
-
-        # 获取语音配置
-        voice_config = next((v for v in VOICE_OPTIONS if v['id'] == voice), None)
-        if not voice_config:
-            raise HTTPException(status_code=400, detail="无效的语音ID")
-
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-            temp_path = temp_file.name
-
-        # 生成语音
-        await synthesize_audio(text, temp_path, voice, volume, pitch)
-
-        # 返回音频文件
-        return FileResponse(
-            temp_path,
-            media_type='audio/mpeg',
-            filename='preview.mp3',
-            background=BackgroundTask(lambda: os.unlink(temp_path))
-        )
-
-    except Exception as e:
-        logging.error(f"语音预览失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    """试听；音量为 1 时流式返回，其他音量合成完整音频并按生成视频时的方式缩放"""
+    return await _preview_response(text, voice, pitch, backend, volume)
+
+
+@app.get("/preview_voice/metrics")
+async def preview_voice_metrics():
+    count = PREVIEW_STATS["count"]
+    return {
+        "status": "success",
+        "count": count,
+        "avg_ttfb": round(PREVIEW_STATS["ttfb_total"] / count, 3) if count else None,
+        "avg_total": round(PREVIEW_STATS["time_total"] / count, 3) if count else None,
+        "last": PREVIEW_STATS["last"],
+        "tts_cache": get_tts_cache().stats(),
+    }
 
 
 @app.get("/get_guide_content/{step_name}/{content_type}")
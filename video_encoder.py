@@ -0,0 +1,198 @@
+import logging
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+from moviepy.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# 与原 moviepy 输出一致的编码参数
+FPS = 24
+VIDEO_CODEC = "libx264"
+VIDEO_PRESET = "medium"
+AUDIO_CODEC = "aac"
+AUDIO_RATE = 44100
+AUDIO_CHANNELS = 2
+# 每个分镜只编码一小段循环单元，其余时长通过 concat 重复引用该单元（流复制），编码耗时与分镜时长基本无关
+LOOP_UNIT_FRAMES = 48
+
+
+def run_ffmpeg(args, data=None):
+    result = subprocess.run([get_setting("FFMPEG_BINARY"), "-v", "error", "-y", *args],
+                            input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 执行失败: {result.stderr.decode('utf-8', 'ignore').strip()}")
+    return result.stdout
+
+
+def segment_frames(duration, fps=FPS):
+    """分镜片段的帧数：向上取整到整帧，旁白不足的部分补静音，片段之间互不依赖，可以单独缓存"""
+    return max(1, math.ceil(duration * fps - 1e-6))
+
+
+def fit_audio(pcm, frame_count, fps, sample_rate):
+    """把一段旁白补静音（或截断）到正好 frame_count 帧的长度，保证拼接后音画不会累计偏移"""
+    pcm = np.asarray(pcm, dtype=np.float32)
+    pcm = pcm.reshape(len(pcm), -1)
+    target = round(frame_count * sample_rate / fps)
+    if len(pcm) >= target:
+        return pcm[:target]
+    return np.concatenate([pcm, np.zeros((target - len(pcm), pcm.shape[1]), dtype=np.float32)])
+
+
+def as_rgb_array(frame):
+    """帧可以是 RGB 数组、PIL.Image 或图片路径"""
+    if isinstance(frame, np.ndarray):
+        return np.ascontiguousarray(frame[..., :3], dtype=np.uint8)
+    img = frame if isinstance(frame, Image.Image) else Image.open(frame)
+    return np.asarray(img.convert("RGB"))
+
+
+def concat_entry(path):
+    return "file '{}'\n".format(str(path).replace("'", "'\\''"))
+
+
+class StillVideoEncoder:
+    """
+    静态画面视频编码器：每个分镜是一张静止画面加一段旁白，
+    - 每张画面只通过管道交给 ffmpeg 一次，循环编码成固定帧数的片段，片段可按分镜缓存复用
+    - 各片段用 concat 流复制拼接，最后一次性混入旁白和背景音乐
+    编码参数与原 write_videofile(fps=24, codec='libx264', audio_codec='aac') 相同
+    """
+
+    def __init__(self, fps=FPS, preset=VIDEO_PRESET, threads=4, workers=None, loop_unit=LOOP_UNIT_FRAMES,
+                 audio_codec=AUDIO_CODEC):
+        self.fps = fps
+        self.preset = preset
+        self.audio_codec = audio_codec
+        self.threads = threads
+        self.workers = workers or int(os.getenv("ENCODE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+        self.loop_unit = loop_unit
+
+    def encode_still(self, frame, frame_count, output_path):
+        """把一张画面编码为 frame_count 帧的视频片段（无音频）"""
+        frame = as_rgb_array(frame)
+        height, width = frame.shape[:2]
+        threads = ["-threads", str(self.threads)] if self.threads else []
+        run_ffmpeg([
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-framerate", str(self.fps),
+            "-i", "pipe:0", "-vf", "loop=loop=-1:size=1:start=0", "-frames:v", str(frame_count),
+            "-c:v", VIDEO_CODEC, "-preset", self.preset, "-pix_fmt", "yuv420p", "-r", str(self.fps),
+            *threads, str(output_path),
+        ], frame.tobytes())
+        return str(output_path)
+
+    def profile(self):
+        """影响片段内容的编码参数，参与片段缓存的 key"""
+        return {"fps": self.fps, "codec": VIDEO_CODEC, "preset": self.preset, "pix_fmt": "yuv420p"}
+
+    def encode_segment(self, frame, frame_count, output_path):
+        """
+        编码一个分镜片段（frame_count 帧）：只编码一个循环单元和余数部分，
+        再用 concat 流复制把重复的单元拼成一个文件，耗时与分镜时长基本无关
+        """
+        repeats, remainder = divmod(frame_count, self.loop_unit)
+        if not repeats or (repeats == 1 and not remainder):
+            return self.encode_still(frame, frame_count, output_path)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as tmp_dir:
+            entries = [self.encode_still(frame, self.loop_unit, os.path.join(tmp_dir, "unit.mp4"))] * repeats
+            if remainder:
+                entries.append(self.encode_still(frame, remainder, os.path.join(tmp_dir, "rest.mp4")))
+            list_path = os.path.join(tmp_dir, "entries.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                f.writelines(concat_entry(path) for path in entries)
+            run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", str(output_path)])
+        return str(output_path)
+
+    def mux(self, segments, output_path, audio, sample_rate, bgm_path=None, bgm_volume=0.3, work_dir=None):
+        """
+        拼接视频片段并混入音频：audio 为整段旁白的 PCM（float32，-1~1），
+        背景音乐循环到视频长度、按 bgm_volume 缩放后与旁白直接相加（与 CompositeAudioClip 一致）
+        """
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+            list_path = os.path.join(tmp_dir, "segments.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                f.writelines(concat_entry(os.path.abspath(path)) for path in segments)
+
+            audio = np.asarray(audio, dtype=np.float32)
+            channels = 1 if audio.ndim == 1 else audio.shape[1]
+            args = ["-f", "concat", "-safe", "0", "-i", list_path,
+                    "-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0"]
+            if bgm_path:
+                args += ["-stream_loop", "-1", "-i", str(bgm_path), "-filter_complex",
+                         f"[2:a]volume={bgm_volume}[bgm];[1:a][bgm]amix=inputs=2:duration=first:normalize=0[a]",
+                         "-map", "0:v", "-map", "[a]"]
+            else:
+                args += ["-map", "0:v", "-map", "1:a"]
+            args += ["-c:v", "copy", "-c:a", self.audio_codec, "-ar", str(AUDIO_RATE), "-ac", str(AUDIO_CHANNELS),
+                     "-t", f"{len(audio) / sample_rate:.3f}", "-movflags", "+faststart", str(output_path)]
+            run_ffmpeg(args, audio.tobytes())
+        return str(output_path)
+
+    def render(self, frames, audios, output_path, sample_rate, bgm_path=None, bgm_volume=0.3,
+               keys=None, cache=None, cached=None, progress=None, work_dir=None):
+        """
+        frames 与 audios 一一对应（每个分镜一张画面、一段 PCM 旁白），分镜时长等于旁白时长（补齐到整帧）；
+        传入 keys 和 cache（SegmentCache）时按分镜缓存编码好的片段：
+        - cached[i] 为预先查到的 (片段路径, 元数据) 时直接复用，此时 frames[i] 可以为 None
+        - 其余分镜并行编码（ENCODE_WORKERS 个 ffmpeg 进程）后写入缓存
+        最后所有片段流复制拼接，旁白和背景音乐一次性混音，返回输出路径；
+        progress(已完成步数, 总步数) 在每个片段编码完成及混音完成时调用；临时文件写在 work_dir 下
+        """
+        count = len(audios)
+        keys = keys or [None] * count
+        cached = cached or [None] * count
+        with tempfile.TemporaryDirectory(dir=work_dir) as work_dir:
+            segments = [None] * count
+            frame_numbers = [None] * count
+            pending = []
+            for index, hit in enumerate(cached):
+                if hit is not None:
+                    # 固定到工作目录，避免拼接前被其他任务淘汰
+                    segments[index] = pin_file(hit[0], os.path.join(work_dir, f"scene_{index}.mp4"))
+                    frame_numbers[index] = hit[1]["frames"]
+                else:
+                    frame_numbers[index] = segment_frames(len(audios[index]) / sample_rate, self.fps)
+                    pending.append(index)
+
+            steps = len(pending) + 1
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self.encode_segment, frames[index], frame_numbers[index],
+                                       os.path.join(work_dir, f"scene_{index}.mp4")): index for index in pending}
+                try:
+                    for done, future in enumerate(as_completed(futures), 1):
+                        index = futures[future]
+                        segments[index] = future.result()
+                        if cache is not None and keys[index] is not None:
+                            cache.save(keys[index], segments[index], {"frames": frame_numbers[index], "fps": self.fps})
+                        if progress is not None:
+                            progress(done, steps)
+                except BaseException:
+                    # 出错或被取消时不再启动尚未开始的片段
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            audio = np.concatenate([fit_audio(pcm, number, self.fps, sample_rate)
+                                    for pcm, number in zip(audios, frame_numbers)])
+            self.mux(segments, output_path, audio, sample_rate, bgm_path, bgm_volume, work_dir)
+            if progress is not None:
+                progress(steps, steps)
+        logger.info(f"视频编码完成: {output_path}（{count} 个分镜，复用 {count - len(pending)} 个片段，"
+                    f"编码 {len(pending)} 个，{sum(frame_numbers)} 帧）")
+        return str(output_path)
+
+
+def pin_file(path, target):
+    """硬链接（跨文件系统时复制）到 target"""
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+    return target
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+
+# 采样器节点类型
+SAMPLER_TYPES = ("KSampler", "KSamplerAdvanced")
+# 文本编码节点类型
+TEXT_ENCODE_TYPES = ("CLIPTextEncode",)
+# 空 Latent 节点类型
+LATENT_TYPES = ("EmptyLatentImage",)
+# 模型加载节点类型：切换这些节点的参数会让 ComfyUI 重新加载或重新打补丁
+CHECKPOINT_TYPES = ("CheckpointLoaderSimple", "CheckpointLoader", "UNETLoader")
+LORA_TYPES = ("LoraLoader", "LoraLoaderModelOnly")
+
+# 已解析的工作流缓存：绝对路径 -> (mtime_ns, size, WorkflowTemplate)
+_TEMPLATE_CACHE = {}
+
+
+class WorkflowTemplate:
+    """
+    解析一次的 ComfyUI 工作流模板：
+    - 按 class_type 和节点连线找到正向/负向 CLIPTextEncode、KSampler、EmptyLatentImage，不依赖固定的节点编号
+    - patch() 只复制被修改的节点，其余节点与模板共享，生成提交用的 prompt 代价很低
+    """
+
+    def __init__(self, path, workflow, content_hash):
+        self.path = path
+        self.workflow = workflow
+        self.content_hash = content_hash
+
+        self.sampler_id = self._find_first(SAMPLER_TYPES)
+        if self.sampler_id is None:
+            raise ValueError(f"工作流中找不到 KSampler 节点: {path}")
+        sampler_inputs = self.workflow[self.sampler_id]["inputs"]
+        self.seed_key = "noise_seed" if "noise_seed" in sampler_inputs else "seed"
+        self.positive_id = self._find_upstream(sampler_inputs.get("positive"), TEXT_ENCODE_TYPES)
+        self.negative_id = self._find_upstream(sampler_inputs.get("negative"), TEXT_ENCODE_TYPES)
+        self.latent_id = self._find_upstream(sampler_inputs.get("latent_image"), LATENT_TYPES)
+        if self.positive_id is None:
+            raise ValueError(f"工作流中找不到正向提示词节点: {path}")
+
+    def _find_first(self, class_types):
+        for node_id, node in self.workflow.items():
+            if node.get("class_type") in class_types:
+                return node_id
+        return None
+
+    # 沿连线向上游查找指定类型的节点，例如 KSampler.positive -> (ControlNetApply ->) CLIPTextEncode
+    def _find_upstream(self, link, class_types):
+        visited = set()
+        pending = [link]
+        while pending:
+            link = pending.pop(0)
+            if not isinstance(link, list) or not link:
+                continue
+            node_id = str(link[0])
+            if node_id in visited or node_id not in self.workflow:
+                continue
+            visited.add(node_id)
+            node = self.workflow[node_id]
+            if node.get("class_type") in class_types:
+                return node_id
+            pending.extend(value for value in node.get("inputs", {}).values() if isinstance(value, list))
+        return None
+
+    @property
+    def signature(self):
+        return workflow_signature(self.workflow)
+
+    @property
+    def negative_text(self):
+        if self.negative_id is None:
+            return ""
+        return self.workflow[self.negative_id]["inputs"].get("text", "")
+
+    @property
+    def resolution(self):
+        if self.latent_id is None:
+            return None
+        inputs = self.workflow[self.latent_id]["inputs"]
+        return inputs.get("width"), inputs.get("height")
+
+    def patch(self, positive, negative=None, seed=None, width=None, height=None, batch_size=None):
+        """
+        生成可直接提交的 prompt：
+        negative 会追加在工作流自带的负向提示词后面；width/height/batch_size 修改 EmptyLatentImage
+        """
+        prompt = dict(self.workflow)
+
+        def touch(node_id, **inputs):
+            node = dict(prompt[node_id])
+            node["inputs"] = {**node["inputs"], **inputs}
+            prompt[node_id] = node
+
+        touch(self.positive_id, text=positive)
+        if negative and self.negative_id is not None:
+            base = self.negative_text.strip().rstrip(",")
+            touch(self.negative_id, text=f"{base},{negative}" if base else negative)
+        if seed is not None and self.seed_key in self.workflow[self.sampler_id]["inputs"]:
+            touch(self.sampler_id, **{self.seed_key: seed})
+
+        latent_inputs = {key: value for key, value in
+                         (("width", width), ("height", height), ("batch_size", batch_size)) if value is not None}
+        if latent_inputs and self.latent_id is not None:
+            touch(self.latent_id, **latent_inputs)
+        return prompt
+
+
+def workflow_signature(prompt_workflow):
+    """
+    工作流的模型签名：(checkpoint 集合, LoRA 及强度集合)
+    签名相同的任务连续执行时 ComfyUI 不需要切换模型
+    """
+    checkpoints = []
+    loras = []
+    for node in prompt_workflow.values():
+        class_type = node.get("class_type")
+        inputs = node.get("inputs", {})
+        if class_type in CHECKPOINT_TYPES:
+            checkpoints.append(str(inputs.get("ckpt_name") or inputs.get("unet_name")))
+        elif class_type in LORA_TYPES:
+            loras.append((str(inputs.get("lora_name")), inputs.get("strength_model"), inputs.get("strength_clip")))
+    return tuple(sorted(checkpoints)), tuple(sorted(loras, key=str))
+
+
+def load_workflow(path):
+    """读取工作流模板，按路径和修改时间缓存，文件未变化时不重复解析"""
+    abs_path = os.path.abspath(str(path))
+    stat = os.stat(abs_path)
+    cached = _TEMPLATE_CACHE.get(abs_path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    with open(abs_path, "rb") as f:
+        raw = f.read()
+    template = WorkflowTemplate(abs_path, json.loads(raw.decode("utf-8")), hashlib.sha256(raw).hexdigest())
+    _TEMPLATE_CACHE[abs_path] = (stat.st_mtime_ns, stat.st_size, template)
+    return template